@@ -0,0 +1,81 @@
+""" Builds ANN index of entity vectors and benchmarks its recall against exact search. """
+import time
+
+import numpy
+import prettytable
+import spacy
+import typer
+from spacy.kb import KnowledgeBase
+
+from candidate_generation.ann import IVFIndex
+from datasets.dataset import Dataset
+from utils import fingerprint_files, get_logger
+
+logger = get_logger(__name__)
+
+
+def main(
+    dataset_name: str,
+    language: str,
+    n_lists: int = typer.Option(0, help="Number of clusters. If 0, the square root of the number of entities."),
+    n_iter: int = typer.Option(10, help="Number of k-means iterations."),
+    benchmark: bool = typer.Option(False, help="Benchmark the existing index instead of building one."),
+    n_probes: str = typer.Option("1,2,4,8,16,32", help="Comma-separated numbers of clusters to search in benchmark."),
+    max_n_candidates: int = typer.Option(10, help="Number of nearest neighbours to query in benchmark."),
+    max_n_queries: int = typer.Option(1000, help="Max. number of test set mentions to query in benchmark."),
+):
+    """Build an IVF index of the KB's entity vectors for EmbeddingCandidateSelector and save it next to the KB, or
+    benchmark the recall and latency of the saved index for different numbers of clusters searched (n_probe) against
+    exact search. The benchmark queries the vectors of the entity mentions in the test corpus.
+    dataset_name (str): Dataset name.
+    language (str): Language.
+    """
+    # Run name isn't relevant for the KB.
+    paths = Dataset.assemble_paths(dataset_name, "", language)
+    nlp = spacy.load(paths["nlp_base"])
+
+    if not benchmark:
+        kb = KnowledgeBase(vocab=nlp.vocab, entity_vector_length=nlp.vocab.vectors_length)
+        kb.from_disk(paths["kb"])
+        entity_ids = kb.get_entity_strings()
+        vectors = numpy.asarray([kb.get_vector(ent_id) for ent_id in entity_ids], dtype=numpy.float32)
+        start = time.perf_counter()
+        index = IVFIndex.build(vectors, entity_ids, n_lists=n_lists, n_iter=n_iter)
+        logger.info(
+            f"Built index of {len(entity_ids)} entities in {index.n_lists} clusters in "
+            f"{time.perf_counter() - start:.1f}s."
+        )
+        index.save(paths["ann_index"], fingerprint_files(paths["kb"]))
+        logger.info(f"Saved index at {paths['ann_index']}.")
+        return
+
+    index = IVFIndex.load(paths["ann_index"])
+    docs = Dataset.read_corpus(paths["corpora"] / "test", nlp.vocab)
+    target_vecs = numpy.asarray(
+        [ent.vector for doc in docs for ent in doc.ents][:max_n_queries], dtype=numpy.float32
+    ).reshape(-1, nlp.vocab.vectors_length)
+    if len(target_vecs) == 0:
+        logger.error("No entity mentions found in test corpus.")
+        raise typer.Exit(code=1)
+
+    table = prettytable.PrettyTable(field_names=["n_probe", "Recall", "ms/query", "Speedup"])
+    exact_ms = None
+    for n_probe in [0] + [int(n_probe) for n_probe in n_probes.split(",") if int(n_probe) < index.n_lists]:
+        start = time.perf_counter()
+        nn_idxs = index.search(target_vecs, max_n_candidates, n_probe)
+        ms = (time.perf_counter() - start) * 1000 / len(target_vecs)
+        if n_probe == 0:
+            exact_nn_idxs, exact_ms = nn_idxs, ms
+        recall = numpy.mean(
+            [len(set(nn_idx) & set(exact)) / max(1, len(exact)) for nn_idx, exact in zip(nn_idxs, exact_nn_idxs)]
+        )
+        table.add_row([n_probe or f"exact ({index.n_lists})", f"{recall:.3f}", f"{ms:.3f}", f"{exact_ms / ms:.1f}x"])
+
+    logger.info(
+        f"Recall@{max_n_candidates} of {index.n_lists}-cluster index vs. exact search for {len(target_vecs)} "
+        f"mentions:\n{table}"
+    )
+
+
+if __name__ == "__main__":
+    typer.run(main)
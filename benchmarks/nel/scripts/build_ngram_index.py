@@ -0,0 +1,40 @@
+""" Builds character n-gram index of KB aliases. """
+import time
+
+import spacy
+import typer
+from spacy.kb import KnowledgeBase
+
+from candidate_generation.ngrams import NGramIndex
+from datasets.dataset import Dataset
+from utils import fingerprint_files, get_logger
+
+logger = get_logger(__name__)
+
+
+def main(
+    dataset_name: str,
+    language: str,
+    n: int = typer.Option(3, help="Length of character n-grams."),
+    n_features: int = typer.Option(2 ** 20, help="Number of features to hash n-grams into."),
+):
+    """Build a TF-IDF weighted character n-gram index of the KB's aliases for LexicalCandidateSelector and save it next
+    to the KB.
+    dataset_name (str): Dataset name.
+    language (str): Language.
+    """
+    # Run name isn't relevant for the KB.
+    paths = Dataset.assemble_paths(dataset_name, "", language)
+    nlp = spacy.load(paths["nlp_base"])
+    kb = KnowledgeBase(vocab=nlp.vocab, entity_vector_length=nlp.vocab.vectors_length)
+    kb.from_disk(paths["kb"])
+
+    start = time.perf_counter()
+    index = NGramIndex.build(kb.get_alias_strings(), n=n, n_features=n_features)
+    logger.info(f"Built index of {len(index)} aliases in {time.perf_counter() - start:.1f}s.")
+    index.save(paths["ngram_index"], fingerprint_files(paths["kb"]))
+    logger.info(f"Saved index at {paths['ngram_index']}.")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,220 @@
+""" Approximate nearest neighbour search in embedding space. """
+import json
+from pathlib import Path
+from typing import List, Optional
+
+import numpy
+
+# Max. number of similarity scores to compute at once, to bound memory usage for large KBs.
+_MAX_SCORES_PER_CHUNK = 2 ** 24
+
+
+class IVFIndex:
+    """Inverted file index for approximate nearest neighbour search by cosine similarity. The entity vectors are
+    clustered with spherical k-means and stored sorted by cluster, so that every cluster is a contiguous block of rows.
+    A query only scores the vectors in the n_probe clusters with the centroids closest to it, which trades recall for
+    latency. The index can be saved to and memory-mapped from disk, so that loading it doesn't require reading all
+    vectors into memory.
+    """
+
+    def __init__(self, centroids: numpy.ndarray, offsets: numpy.ndarray, vectors: numpy.ndarray, entity_ids: List[str]):
+        """Initializes new IVFIndex.
+        centroids (numpy.ndarray): Normalized cluster centroids, one per row.
+        offsets (numpy.ndarray): Offsets of the clusters' blocks in vectors, with len(centroids) + 1 entries.
+        vectors (numpy.ndarray): Normalized entity vectors, sorted by cluster.
+        entity_ids (List[str]): Entity IDs, in the order of vectors.
+        """
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.entity_ids = entity_ids
+
+    @property
+    def n_lists(self) -> int:
+        """Returns number of clusters."""
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: numpy.ndarray,
+        entity_ids: List[str],
+        n_lists: int = 0,
+        n_iter: int = 10,
+        sample_size: int = 64,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Clusters entity vectors and builds index.
+        vectors (numpy.ndarray): Entity vectors, one per row.
+        entity_ids (List[str]): Entity IDs, in the order of vectors.
+        n_lists (int): Number of clusters. If 0, the square root of the number of entities is used.
+        n_iter (int): Number of k-means iterations.
+        sample_size (int): Number of vectors per cluster to sample for fitting the centroids.
+        seed (int): Random seed.
+        RETURNS (IVFIndex): Index.
+        """
+        vectors = normalize(numpy.asarray(vectors, dtype=numpy.float32))
+        n_lists = max(1, min(n_lists or int(numpy.sqrt(len(vectors))), len(vectors)))
+        centroids = _fit_centroids(vectors, n_lists, n_iter, sample_size, numpy.random.default_rng(seed))
+        assignments = _assign(vectors, centroids)
+        order = numpy.argsort(assignments, kind="stable")
+        offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(assignments, minlength=n_lists))])
+
+        return cls(centroids, offsets, vectors[order], [entity_ids[i] for i in order])
+
+    def save(self, path: Path, kb_fingerprint: str = "") -> None:
+        """Saves index to directory.
+        path (Path): Path to directory.
+        kb_fingerprint (str): Fingerprint of the KB the index was built from, see utils.fingerprint_files().
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "meta.json", "w") as file:
+            json.dump({"kb_fingerprint": kb_fingerprint}, file)
+        numpy.save(path / "centroids.npy", self.centroids)
+        numpy.save(path / "offsets.npy", self.offsets)
+        numpy.save(path / "vectors.npy", self.vectors)
+        with open(path / "entity_ids.json", "w") as file:
+            json.dump(self.entity_ids, file)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "IVFIndex":
+        """Loads index from directory.
+        path (Path): Path to directory.
+        mmap (bool): Whether to memory-map the entity vectors instead of reading them into memory.
+        RETURNS (IVFIndex): Index.
+        """
+        with open(path / "entity_ids.json", "r") as file:
+            entity_ids = json.load(file)
+
+        return cls(
+            numpy.load(path / "centroids.npy"),
+            numpy.load(path / "offsets.npy"),
+            numpy.load(path / "vectors.npy", mmap_mode="r" if mmap else None),
+            entity_ids,
+        )
+
+    def search(self, target_vecs: numpy.ndarray, k: int, n_probe: int = 0) -> List[numpy.ndarray]:
+        """Finds the entities with the highest cosine similarity to each of the target vectors.
+        target_vecs (numpy.ndarray): Target vectors, one per row.
+        k (int): Number of nearest neighbours to find per target vector.
+        n_probe (int): Number of clusters to search per target vector. If 0 or at least the number of clusters, all
+            entities are searched, which is exact.
+        RETURNS (List[numpy.ndarray]): Indices of nearest neighbours in self.entity_ids per target vector, from nearest
+            to farthest. Can be fewer than k if the searched clusters contain fewer entities.
+        """
+        target_vecs = normalize(numpy.asarray(target_vecs, dtype=numpy.float32))
+        if n_probe <= 0 or n_probe >= self.n_lists:
+            return list(_top_k(target_vecs, self.vectors, k))
+
+        # Score each probed cluster against all target vectors probing it at once, then merge the per-cluster top k.
+        probes = _top_k(target_vecs, self.centroids, n_probe)
+        nn_idxs: List[List[numpy.ndarray]] = [[] for _ in range(len(target_vecs))]
+        nn_scores: List[List[numpy.ndarray]] = [[] for _ in range(len(target_vecs))]
+        for list_idx in numpy.unique(probes):
+            start, end = self.offsets[list_idx], self.offsets[list_idx + 1]
+            if start == end:
+                continue
+            target_idxs = numpy.nonzero((probes == list_idx).any(axis=1))[0]
+            scores = target_vecs[target_idxs] @ self.vectors[start:end].T
+            top_idxs = _select(scores, min(k, end - start))
+            top_scores = numpy.take_along_axis(scores, top_idxs, axis=1)
+            for i, target_idx in enumerate(target_idxs):
+                nn_idxs[target_idx].append(top_idxs[i] + start)
+                nn_scores[target_idx].append(top_scores[i])
+
+        results = []
+        for idxs, scores in zip(nn_idxs, nn_scores):
+            idxs = numpy.concatenate(idxs) if idxs else numpy.zeros(0, dtype=numpy.int64)
+            scores = numpy.concatenate(scores) if scores else numpy.zeros(0, dtype=numpy.float32)
+            results.append(idxs[numpy.argsort(-scores, kind="stable")[:k]])
+
+        return results
+
+
+def load_index(path: Path, n_entities: int, vector_length: int, kb_fingerprint: str) -> Optional[IVFIndex]:
+    """Loads index from directory, if it exists and was built from the KB.
+    path (Path): Path to directory.
+    n_entities (int): Number of entities in KB.
+    vector_length (int): Length of entity vectors in KB.
+    kb_fingerprint (str): Fingerprint of KB, see utils.fingerprint_files().
+    RETURNS (Optional[IVFIndex]): Memory-mapped index, or None if there is no index matching the KB.
+    """
+    if not (path / "meta.json").exists() or not (path / "vectors.npy").exists():
+        return None
+    with open(path / "meta.json", "r") as file:
+        if json.load(file).get("kb_fingerprint") != kb_fingerprint:
+            return None
+    index = IVFIndex.load(path)
+
+    return index if index.vectors.shape == (n_entities, vector_length) else None
+
+
+def normalize(vecs: numpy.ndarray) -> numpy.ndarray:
+    """Scales vectors to unit length. Zero vectors are left as they are.
+    vecs (numpy.ndarray): Vectors, one per row.
+    RETURNS (numpy.ndarray): Normalized vectors.
+    """
+    norms = numpy.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / numpy.where(norms == 0, 1, norms)
+
+
+def _select(scores: numpy.ndarray, k: int) -> numpy.ndarray:
+    """Selects the indices of the k highest scores per row, from highest to lowest.
+    scores (numpy.ndarray): Scores, one row per target vector.
+    k (int): Number of scores to select per row.
+    RETURNS (numpy.ndarray): Indices of k highest scores per row.
+    """
+    # Select the top k in linear time, then sort only those.
+    top_idxs = numpy.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = numpy.argsort(-numpy.take_along_axis(scores, top_idxs, axis=1), axis=1, kind="stable")
+    return numpy.take_along_axis(top_idxs, order, axis=1)
+
+
+def _top_k(target_vecs: numpy.ndarray, vecs: numpy.ndarray, k: int) -> numpy.ndarray:
+    """Finds the k vectors with the highest dot product with each of the target vectors, in chunks.
+    target_vecs (numpy.ndarray): Target vectors, one per row.
+    vecs (numpy.ndarray): Vectors to search, one per row.
+    k (int): Number of vectors to find per target vector.
+    RETURNS (numpy.ndarray): Indices of the k vectors per target vector, from highest to lowest dot product.
+    """
+    k = min(k, len(vecs))
+    if k == 0:
+        return numpy.zeros((len(target_vecs), 0), dtype=numpy.int64)
+    chunk_size = max(1, _MAX_SCORES_PER_CHUNK // max(1, len(vecs)))
+    return numpy.concatenate(
+        [_select(target_vecs[i: i + chunk_size] @ vecs.T, k) for i in range(0, len(target_vecs), chunk_size)]
+    )
+
+
+def _assign(vecs: numpy.ndarray, centroids: numpy.ndarray) -> numpy.ndarray:
+    """Assigns vectors to the cluster with the closest centroid.
+    vecs (numpy.ndarray): Normalized vectors, one per row.
+    centroids (numpy.ndarray): Normalized centroids, one per row.
+    RETURNS (numpy.ndarray): Cluster index per vector.
+    """
+    return _top_k(vecs, centroids, 1)[:, 0]
+
+
+def _fit_centroids(
+    vecs: numpy.ndarray, n_lists: int, n_iter: int, sample_size: int, rng: numpy.random.Generator
+) -> numpy.ndarray:
+    """Fits cluster centroids with spherical k-means on a sample of the vectors.
+    vecs (numpy.ndarray): Normalized vectors, one per row.
+    n_lists (int): Number of clusters.
+    n_iter (int): Number of k-means iterations.
+    sample_size (int): Number of vectors per cluster to sample.
+    rng (numpy.random.Generator): Random number generator.
+    RETURNS (numpy.ndarray): Normalized centroids, one per row.
+    """
+    sample = vecs[rng.choice(len(vecs), min(len(vecs), n_lists * sample_size), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+    for _ in range(n_iter if n_lists > 1 else 0):
+        assignments = _assign(sample, centroids)
+        sums = numpy.zeros_like(centroids)
+        numpy.add.at(sums, assignments, sample)
+        # Re-seed empty clusters with random vectors from the sample.
+        empty = numpy.bincount(assignments, minlength=n_lists) == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+
+    return centroids
@@ -1,7 +1,7 @@
 """ Base class generation for candidate selection. """
 import abc
 import pickle
-from typing import Dict, Any, Optional, Iterable, Tuple
+from typing import Dict, Any, Optional, Iterable, List, Tuple
 
 import spacy
 from spacy import Language
@@ -9,17 +9,36 @@ from spacy.kb import KnowledgeBase, Candidate
 from spacy.tokens import Span
 
 from datasets.dataset import Dataset
+from .cache import CandidateCache
 
 
 class NearestNeighborCandidateSelector(abc.ABC):
-    """Callable object selecting candidates via nearest neighbour search."""
+    """Callable object selecting candidates via nearest neighbour search. If a CandidateCache is given, the candidates
+    for each mention are memoized by the normalized mention text, the selector config and whether the lookup structure
+    was loaded from disk."""
 
     _pipeline: Optional[Language] = None
     _lookup_struct: Optional[Any] = None
+    # Whether _lookup_struct is an index loaded from disk, as opposed to one built in memory as a fallback.
+    _lookup_struct_loaded: bool = False
     _entities: Dict[str, Any] = {}
 
+    def __init__(self, cache: Optional[CandidateCache] = None):
+        """Initializes new NearestNeighborCandidateSelector.
+        cache (Optional[CandidateCache]): Cache for candidates. Can be shared by several selectors. If None, candidates
+            aren't cached.
+        """
+        self._cache = cache
+
     def __call__(
-        self, kb: KnowledgeBase, span: Span, dataset_id: str, language: str, max_n_candidates: int, **kwargs
+        self,
+        kb: KnowledgeBase,
+        span: Span,
+        dataset_id: str,
+        language: str,
+        max_n_candidates: int,
+        persist_cache: bool = False,
+        **kwargs
     ) -> Iterable[Candidate]:
         """Identifies entity candidates.
         kb (KnowledgeBase): KnowledgeBase containing all possible entity candidates.
@@ -27,9 +46,79 @@ class NearestNeighborCandidateSelector(abc.ABC):
         dataset_id (str): ID of dataset for which to select candidates.
         language (str): Language.
         max_n_candidates (int): Numbers of nearest neighbours to query.
+        persist_cache (bool): Whether to load cached candidates from and save them to disk.
         RETURNS (Iterator[Candidate]): Candidates for specified entity.
         """
 
+        self._init(kb, dataset_id, language, max_n_candidates, persist_cache, **kwargs)
+        if self._cache is None:
+            return self._fetch_candidates(dataset_id, span, kb, max_n_candidates, **kwargs)
+
+        key = self._cache_key(span, dataset_id, language, max_n_candidates, **kwargs)
+        candidates = self._cache.get(key, kb)
+        if candidates is None:
+            # Retrieve candidates from KB.
+            candidates = self._fetch_candidates(dataset_id, span, kb, max_n_candidates, **kwargs)
+            self._cache.put(key, candidates)
+
+        return candidates
+
+    def batch(
+        self,
+        kb: KnowledgeBase,
+        spans: Iterable[Span],
+        dataset_id: str,
+        language: str,
+        max_n_candidates: int,
+        persist_cache: bool = False,
+        **kwargs
+    ) -> List[Iterable[Candidate]]:
+        """Identifies entity candidates for several spans at once.
+        kb (KnowledgeBase): KnowledgeBase containing all possible entity candidates.
+        spans (Iterable[Span]): Spans to match potential entity candidates with.
+        dataset_id (str): ID of dataset for which to select candidates.
+        language (str): Language.
+        max_n_candidates (int): Numbers of nearest neighbours to query.
+        persist_cache (bool): Whether to load cached candidates from and save them to disk.
+        RETURNS (List[Iterable[Candidate]]): Candidates per span, in the order of the spans.
+        """
+
+        self._init(kb, dataset_id, language, max_n_candidates, persist_cache, **kwargs)
+        spans = list(spans)
+        if self._cache is None:
+            return self._fetch_candidates_batch(dataset_id, spans, kb, max_n_candidates, **kwargs)
+
+        # Only fetch candidates for spans that aren't cached.
+        keys = [self._cache_key(span, dataset_id, language, max_n_candidates, **kwargs) for span in spans]
+        candidates = [self._cache.get(key, kb) for key in keys]
+        missing_idxs = [i for i, cands in enumerate(candidates) if cands is None]
+        fetched = self._fetch_candidates_batch(
+            dataset_id, [spans[i] for i in missing_idxs], kb, max_n_candidates, **kwargs
+        )
+        for i, cands in zip(missing_idxs, fetched):
+            candidates[i] = cands
+            self._cache.put(keys[i], cands)
+
+        return candidates
+
+    def _init(
+        self,
+        kb: KnowledgeBase,
+        dataset_id: str,
+        language: str,
+        max_n_candidates: int,
+        persist_cache: bool = False,
+        **kwargs
+    ) -> None:
+        """Loads pipeline and entities and initializes lookup structure and cache persistence, if that hasn't happened
+        yet.
+        kb (KnowledgeBase): KnowledgeBase containing all possible entity candidates.
+        dataset_id (str): ID of dataset for which to select candidates.
+        language (str): Language.
+        max_n_candidates (int): Numbers of nearest neighbours to query.
+        persist_cache (bool): Whether to load cached candidates from and save them to disk.
+        """
+
         if self._pipeline is None:
             # Load pipeline and pickled entities. Run name doesn't matter for either of those.
             paths = Dataset.assemble_paths(dataset_id, "", language)
@@ -37,15 +126,45 @@ class NearestNeighborCandidateSelector(abc.ABC):
             with open(paths["entities"], "rb") as file:
                 self._entities[dataset_id] = pickle.load(file)
         if self._lookup_struct is None:
-            self._lookup_struct = self._init_lookup_structure(kb, max_n_candidates, **kwargs)
+            self._lookup_struct = self._init_lookup_structure(kb, dataset_id, language, max_n_candidates, **kwargs)
+        if persist_cache and self._cache is not None:
+            paths = Dataset.assemble_paths(dataset_id, "", language)
+            self._cache.persist(paths["candidate_cache"], (paths["kb"], paths["ann_index"], paths["ngram_index"]))
+
+    def _cache_key(self, span: Span, dataset_id: str, language: str, max_n_candidates: int, **kwargs) -> Tuple:
+        """Assembles cache key of span's candidates from normalized mention text, selector config and index mode.
+        span (Span): candidate span.
+        dataset_id (str): ID of dataset for which to select candidates.
+        language (str): Language.
+        max_n_candidates (int): Max. number of candidates to generate.
+        RETURNS (Tuple): Cache key.
+        """
+        return (
+            type(self).__name__,
+            dataset_id,
+            language,
+            max_n_candidates,
+            tuple(sorted(kwargs.items())),
+            self._lookup_struct_loaded,
+            self._normalize_mention(span),
+        )
 
-        # Retrieve candidates from KB.
-        return self._fetch_candidates(dataset_id, span, kb, max_n_candidates, **kwargs)
+    def _normalize_mention(self, span: Span) -> str:
+        """Normalizes mention text for caching. Spans with the same normalized text have to get the same candidates.
+        span (Span): candidate span.
+        RETURNS (str): Normalized mention text.
+        """
+        return span.text
 
     @abc.abstractmethod
-    def _init_lookup_structure(self, kb: KnowledgeBase, max_n_candidates: int, **kwargs) -> Any:
+    def _init_lookup_structure(
+        self, kb: KnowledgeBase, dataset_id: str, language: str, max_n_candidates: int, **kwargs
+    ) -> Any:
         """Init container for lookups for new dataset. Doesn't do anything if initialized for this dataset already.
+        Implementations set _lookup_struct_loaded if the container is loaded from disk.
         kb (KnowledgeBase): KnowledgeBase containing all possible entity candidates.
+        dataset_id (str): ID of dataset for which to select candidates.
+        language (str): Language.
         max_n_candidates (int): Max. number of candidates to generate.
         RETURNS (Any): Initialized container.
         """
@@ -68,3 +187,21 @@ class NearestNeighborCandidateSelector(abc.ABC):
         RETURNS (Iterator[Candidate]): Candidates for specified entity.
         """
         raise NotImplementedError
+
+    def _fetch_candidates_batch(
+        self,
+        dataset_id: str,
+        spans: List[Span],
+        kb: KnowledgeBase,
+        max_n_candidates: int,
+        **kwargs
+    ) -> List[Iterable[Candidate]]:
+        """Fetches candidates for entities in several spans. Fetches them one by one by default, selectors that can
+        look up several spans at once more efficiently override this.
+        dataset_id (str): ID of dataset for which to select candidates.
+        spans (List[Span]): candidate spans.
+        kb (KnowledgeBase): KnowledgeBase containing all possible entity candidates.
+        max_n_candidates (int): Max. number of candidates to generate.
+        RETURNS (List[Iterable[Candidate]]): Candidates per span.
+        """
+        return [self._fetch_candidates(dataset_id, span, kb, max_n_candidates, **kwargs) for span in spans]
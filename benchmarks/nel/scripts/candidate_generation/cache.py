@@ -0,0 +1,133 @@
+""" Memoization of candidate lists across spans and runs. """
+import atexit
+import os
+import pickle
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from spacy.kb import Candidate, KnowledgeBase
+
+from utils import fingerprint_files, get_logger
+
+logger = get_logger(__name__)
+
+
+class CandidateCache:
+    """Bounded LRU cache of the candidates selected for a mention, keyed by the normalized mention text and the config
+    of the selector. Candidates are stored as (alias, entity ID) pairs and restored from the KB on lookup, so that the
+    cache can be persisted to disk and reused by later runs with the same KB and indexes. Hit rate statistics are logged
+    when the process exits.
+    """
+
+    def __init__(self, max_size: int = 2 ** 17):
+        """Initializes new CandidateCache.
+        max_size (int): Max. number of mentions to cache. If 0, the cache isn't bounded.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[str, str], ...]]" = OrderedDict()
+        self._path: Optional[Path] = None
+        self._fingerprint: Optional[str] = None
+        self._exit_handler_registered = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """Returns share of lookups answered from the cache."""
+        return self.hits / max(1, self.hits + self.misses)
+
+    def get(self, key: Hashable, kb: KnowledgeBase) -> Optional[List[Candidate]]:
+        """Looks up cached candidates.
+        key (Hashable): Normalized mention text and selector config.
+        kb (KnowledgeBase): KnowledgeBase to restore candidates from.
+        RETURNS (Optional[List[Candidate]]): Cached candidates, or None if mention isn't cached.
+        """
+        self._register_exit_handler()
+        pairs = self._entries.get(key)
+        if pairs is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        entity_ids_by_alias: Dict[str, Set[str]] = defaultdict(set)
+        for alias, entity_id in pairs:
+            entity_ids_by_alias[alias].add(entity_id)
+        return [
+            cand
+            for alias, entity_ids in entity_ids_by_alias.items()
+            for cand in kb.get_alias_candidates(alias)
+            if cand.entity_ in entity_ids
+        ]
+
+    def put(self, key: Hashable, candidates: Iterable[Candidate]) -> None:
+        """Caches candidates, evicting the least recently used mention if the cache is full.
+        key (Hashable): Normalized mention text and selector config.
+        candidates (Iterable[Candidate]): Candidates selected for mention.
+        """
+        self._entries[key] = tuple((cand.alias_, cand.entity_) for cand in candidates)
+        self._entries.move_to_end(key)
+        if self.max_size and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def persist(self, path: Path, data_paths: Iterable[Path]) -> None:
+        """Loads cached candidates from path, if they were cached for the same data, and saves the cache there when the
+        process exits. Doesn't do anything if the cache is persisted already.
+        path (Path): Path to cache file.
+        data_paths (Iterable[Path]): Paths to the KB and the indexes candidates are selected with. The cached candidates
+            are discarded if any of them changed, see utils.fingerprint_files().
+        """
+        if self._path is not None:
+            return
+        self._path = path
+        self._fingerprint = fingerprint_files(*data_paths)
+        self._register_exit_handler()
+        if not path.exists():
+            return
+
+        with open(path, "rb") as file:
+            cached = pickle.load(file)
+        if cached.get("fingerprint") != self._fingerprint:
+            logger.info(f"Ignoring candidate cache at {path}, it was created for a different KB or different indexes.")
+            return
+        # Keep entries cached in this run, as they are more recent.
+        entries = OrderedDict(cached["entries"])
+        for key, pairs in self._entries.items():
+            entries[key] = pairs
+            entries.move_to_end(key)
+        self._entries = entries
+        while self.max_size and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(cached['entries'])} cached candidate lists from {path}.")
+
+    def save(self, path: Path) -> None:
+        """Saves cache to file.
+        path (Path): Path to cache file.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to temporary file first, so that an interrupted write doesn't corrupt an existing cache.
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as file:
+            pickle.dump({"fingerprint": self._fingerprint, "entries": list(self._entries.items())}, file)
+        os.replace(tmp_path, path)
+
+    def _register_exit_handler(self) -> None:
+        """Registers handler reporting hit rate statistics and saving the cache, if it's persisted, on exit."""
+        if not self._exit_handler_registered:
+            atexit.register(self._on_exit)
+            self._exit_handler_registered = True
+
+    def _on_exit(self) -> None:
+        """Reports hit rate statistics and saves cache, if it's persisted."""
+        if self.hits + self.misses:
+            logger.info(
+                f"Candidate cache: {self.hits} hits, {self.misses} misses (hit rate {self.hit_rate:.1%}), "
+                f"{len(self)} mentions cached."
+            )
+        if self._path is not None and self.misses:
+            self.save(self._path)
+            logger.info(f"Saved candidate cache at {self._path}.")
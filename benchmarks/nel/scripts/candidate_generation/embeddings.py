@@ -1,27 +1,76 @@
 """ Candidate generation via distance in embedding space. """
-import time
-from typing import Iterable, List, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import numpy
-from sklearn.neighbors import NearestNeighbors
 
-from spacy.kb import KnowledgeBase
-from spacy.tokens import Span
+from spacy.kb import KnowledgeBase, Candidate
+from spacy.tokens import Doc, Span
+from datasets.dataset import Dataset
+from utils import fingerprint_files, get_logger
+from .ann import IVFIndex, load_index
 from .base import NearestNeighborCandidateSelector
 from rapidfuzz.string_metric import normalized_levenshtein
 
+logger = get_logger(__name__)
+
 
 class EmbeddingCandidateSelector(NearestNeighborCandidateSelector):
-    """Callable object selecting candidates as nearest neighbours in embedding space."""
+    """Callable object selecting candidates as nearest neighbours in embedding space. The lookup structure is an
+    IVFIndex of the normalized entity vectors. If one was built for the KB with scripts/build_ann_index.py, it's
+    memory-mapped from disk, otherwise an index with a single cluster is built in memory. The similarities of a batch of
+    spans to the entities are computed with one matrix product per cluster searched."""
+
+    _lookup_struct: Optional[IVFIndex] = None
+    # Candidates for all entities in the last doc queried, and the settings they were fetched with.
+    _doc: Optional[Doc] = None
+    _doc_settings: Optional[Tuple] = None
+    _doc_candidates: Dict[Tuple[int, int], Iterable[Candidate]] = {}
 
-    _entity_ids: List[str] = []
+    def _init_lookup_structure(
+        self, kb: KnowledgeBase, dataset_id: str, language: str, max_n_candidates: int, **kwargs
+    ) -> IVFIndex:
+        paths = Dataset.assemble_paths(dataset_id, "", language)
+        index_path = paths["ann_index"]
+        index = load_index(index_path, kb.get_size_entities(), kb.entity_vector_length, fingerprint_files(paths["kb"]))
+        self._lookup_struct_loaded = index is not None
+        if index is not None:
+            return index
+        logger.info(f"No ANN index matching the KB found at {index_path}, searching all entity vectors exactly.")
+        entity_ids = kb.get_entity_strings()
+        return IVFIndex.build(
+            numpy.asarray([kb.get_vector(ent_id) for ent_id in entity_ids], dtype=numpy.float32), entity_ids, n_lists=1
+        )
 
-    def _init_lookup_structure(self, kb: KnowledgeBase, max_n_candidates: int, **kwargs) -> NearestNeighbors:
-        container = NearestNeighbors(n_neighbors=max_n_candidates, metric="cosine", n_jobs=1)
-        container.fit(numpy.asarray([kb.get_vector(ent_id) for ent_id in kb.get_entity_strings()]))
-        self._entity_ids = kb.get_entity_strings()
+    def __call__(
+        self,
+        kb: KnowledgeBase,
+        span: Span,
+        dataset_id: str,
+        language: str,
+        max_n_candidates: int,
+        persist_cache: bool = False,
+        **kwargs
+    ) -> Iterable[Candidate]:
+        # spaCy's entity linker asks for the candidates of one span at a time. Select them for all entities in the
+        # span's doc at once instead, and answer the queries for the other entities from those. batch() only searches
+        # the entities that aren't cached yet, and caches what it found for them.
+        settings = (dataset_id, language, max_n_candidates, persist_cache, tuple(sorted(kwargs.items())))
+        if self._doc is not span.doc or self._doc_settings != settings:
+            spans = list(span.doc.ents)
+            self._doc, self._doc_settings = span.doc, settings
+            self._doc_candidates = dict(
+                zip(
+                    [(ent.start, ent.end) for ent in spans],
+                    self.batch(kb, spans, dataset_id, language, max_n_candidates, persist_cache, **kwargs),
+                )
+            )
+        offsets = (span.start, span.end)
+        if offsets not in self._doc_candidates:
+            self._doc_candidates[offsets] = super().__call__(
+                kb, span, dataset_id, language, max_n_candidates, persist_cache, **kwargs
+            )
 
-        return container
+        return self._doc_candidates[offsets]
 
     def _fetch_candidates(
         self,
@@ -30,17 +79,59 @@ class EmbeddingCandidateSelector(NearestNeighborCandidateSelector):
         kb: KnowledgeBase,
         max_n_candidates: int,
         lexical_similarity_cutoff: float = 0.5,
-    ) -> Iterable[int]:
-        target_vec = span.vector
-        if not isinstance(target_vec, numpy.ndarray):
-            target_vec = target_vec.get()
+        n_probe: int = 0,
+    ) -> Iterable[Candidate]:
+        return self._fetch_candidates_batch(
+            dataset_id, [span], kb, max_n_candidates, lexical_similarity_cutoff, n_probe
+        )[0]
 
-        nn_idx = self._lookup_struct.kneighbors(target_vec.reshape((1, -1)))[1][0]
-        nn_entities = {self._entity_ids[i]: self._entities[dataset_id][self._entity_ids[i]] for i in nn_idx}
+    def _fetch_candidates_batch(
+        self,
+        dataset_id: str,
+        spans: List[Span],
+        kb: KnowledgeBase,
+        max_n_candidates: int,
+        lexical_similarity_cutoff: float = 0.5,
+        n_probe: int = 0,
+    ) -> List[Set[Candidate]]:
+        if not spans:
+            return []
+        target_vecs = []
+        for span in spans:
+            target_vec = span.vector
+            if not isinstance(target_vec, numpy.ndarray):
+                target_vec = target_vec.get()
+            target_vecs.append(target_vec)
+        nn_idxs = self._lookup_struct.search(numpy.asarray(target_vecs, dtype=numpy.float32), max_n_candidates, n_probe)
+
+        return [
+            self._filter_candidates(dataset_id, span, kb, nn_idx, lexical_similarity_cutoff)
+            for span, nn_idx in zip(spans, nn_idxs)
+        ]
+
+    def _filter_candidates(
+        self,
+        dataset_id: str,
+        span: Span,
+        kb: KnowledgeBase,
+        nn_idx: numpy.ndarray,
+        lexical_similarity_cutoff: float,
+    ) -> Set[Candidate]:
+        """Keeps nearest neighbours with at least one alias lexically similar enough to the span text.
+        dataset_id (str): ID of dataset for which to select candidates.
+        span (Span): candidate span.
+        kb (KnowledgeBase): KnowledgeBase containing all possible entity candidates.
+        nn_idx (numpy.ndarray): Indices of nearest neighbours in the index's entity IDs.
+        lexical_similarity_cutoff (float): Min. normalized Levenshtein similarity of an alias to the span text.
+        RETURNS (Set[Candidate]): Candidates for span.
+        """
+        entity_ids = self._lookup_struct.entity_ids
+        nn_entities = {entity_ids[i]: self._entities[dataset_id][entity_ids[i]] for i in nn_idx}
+        span_text = span.text.lower()
         candidate_entity_ids: Set[str] = set()
         for nne in nn_entities:
             for name in nn_entities[nne].aliases:
-                if normalized_levenshtein(name.lower(), span.text.lower()) / 100 >= lexical_similarity_cutoff:
+                if normalized_levenshtein(name.lower(), span_text) / 100 >= lexical_similarity_cutoff:
                     candidate_entity_ids.add(nne)
                     break
 
@@ -51,3 +142,4 @@ class EmbeddingCandidateSelector(NearestNeighborCandidateSelector):
             ]
             for cand in cands_for_alias
         }
+
@@ -3,15 +3,34 @@ from typing import Iterable
 
 from spacy.kb import KnowledgeBase, Candidate
 from spacy.tokens import Span
+from datasets.dataset import Dataset
+from utils import fingerprint_files, get_logger
 from .base import NearestNeighborCandidateSelector
-from cfuzzyset import cFuzzySet as FuzzySet
+from .ngrams import NGramIndex, load_index
+
+logger = get_logger(__name__)
 
 
 class LexicalCandidateSelector(NearestNeighborCandidateSelector):
-    """Callable object selecting candidates as nearest neighbours in lexical space."""
+    """Callable object selecting candidates as nearest neighbours in lexical space. The lookup structure is an
+    NGramIndex of the KB's aliases. If one was built for the KB with scripts/build_ngram_index.py, it's memory-mapped
+    from disk, otherwise it's built in memory."""
+
+    def _init_lookup_structure(
+        self, kb: KnowledgeBase, dataset_id: str, language: str, max_n_candidates: int, **kwargs
+    ) -> NGramIndex:
+        paths = Dataset.assemble_paths(dataset_id, "", language)
+        index_path = paths["ngram_index"]
+        index = load_index(index_path, kb.get_size_aliases(), fingerprint_files(paths["kb"]))
+        self._lookup_struct_loaded = index is not None
+        if index is not None:
+            return index
+        logger.info(f"No n-gram index matching the KB found at {index_path}, indexing aliases in memory.")
+        return NGramIndex.build(kb.get_alias_strings())
 
-    def _init_lookup_structure(self, kb: KnowledgeBase, max_n_candidates: int, **kwargs) -> FuzzySet:
-        return FuzzySet(kb.get_alias_strings())
+    def _normalize_mention(self, span: Span) -> str:
+        # The n-grams of the span text are lowercased, so the candidates don't depend on its case.
+        return span.text.lower()
 
     def _fetch_candidates(
         self,
@@ -20,10 +39,11 @@ class LexicalCandidateSelector(NearestNeighborCandidateSelector):
         kb: KnowledgeBase,
         max_n_candidates: int,
         similarity_cutoff: float = 0.5,
+        max_postings: int = 0,
     ) -> Iterable[int]:
         all_cands = [
-            kb.get_alias_candidates(entry[1]) for entry in self._lookup_struct.get(span.text, [])
-            if entry[0] >= similarity_cutoff
-        ][:max_n_candidates]
+            kb.get_alias_candidates(alias)
+            for _, alias in self._lookup_struct.search(span.text, max_n_candidates, similarity_cutoff, max_postings)
+        ]
 
         return {cand for cands_for_alias in all_cands for cand in cands_for_alias}
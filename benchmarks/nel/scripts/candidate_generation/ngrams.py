@@ -0,0 +1,333 @@
+""" Fuzzy string search via TF-IDF weighted character n-grams. """
+import json
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy
+from scipy import sparse
+
+# Number of posting list entries that can be read in the time it takes to score one alias exactly.
+_POSTINGS_PER_SCORING = 20
+
+
+class NGramIndex:
+    """Inverted index of the character n-grams of aliases for fuzzy string search. Aliases and queries are represented
+    as L2-normalized TF-IDF vectors over their lowercased, space-padded character n-grams, which are hashed into a fixed
+    number of features so that no vocabulary has to be stored. The similarity of a query to an alias is the cosine
+    similarity of their vectors.
+    All arrays are stored as .npy files and can be memory-mapped, so that loading the index doesn't require reading it
+    into memory. A lookup reads the posting lists of the query's n-grams from the rarest one on, and stops collecting
+    aliases as soon as the n-grams not read yet can't make any other alias one of the k most similar ones. Only the
+    aliases that can still be among the k most similar ones are then scored exactly. Optionally, aliases are only
+    collected from posting lists up to a max. length, so that the long posting lists of common n-grams are only read
+    to score aliases when that's cheaper than scoring them exactly.
+    """
+
+    def __init__(
+        self,
+        alias_bytes: numpy.ndarray,
+        alias_offsets: numpy.ndarray,
+        idf: numpy.ndarray,
+        alias_ngrams: Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray],
+        ngram_aliases: Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray],
+        n: int = 3,
+    ):
+        """Initializes new NGramIndex.
+        alias_bytes (numpy.ndarray): UTF-8 encoded aliases, concatenated.
+        alias_offsets (numpy.ndarray): Offsets of aliases in alias_bytes, with one entry more than there are aliases.
+        idf (numpy.ndarray): Inverse document frequency per feature.
+        alias_ngrams (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]): indptr, indices and data of CSR matrix with
+            the TF-IDF vector of each alias as rows.
+        ngram_aliases (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]): indptr, indices and data of CSR matrix
+            with the aliases containing each feature as rows, i.e. the transposed alias_ngrams.
+        n (int): Length of n-grams.
+        """
+        self.alias_bytes = alias_bytes
+        self.alias_offsets = alias_offsets
+        self.idf = idf
+        self.alias_ngrams = alias_ngrams
+        self.ngram_aliases = ngram_aliases
+        self.n = n
+        self._scores: Optional[numpy.ndarray] = None
+        self._squared_norms: Optional[numpy.ndarray] = None
+        self._seen: Optional[numpy.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.alias_offsets) - 1
+
+    @property
+    def n_features(self) -> int:
+        """Returns number of hashed n-gram features."""
+        return len(self.idf)
+
+    def alias(self, i: int) -> str:
+        """Returns alias with index i.
+        i (int): Alias index.
+        RETURNS (str): Alias.
+        """
+        return bytes(self.alias_bytes[self.alias_offsets[i]: self.alias_offsets[i + 1]]).decode("utf-8")
+
+    @classmethod
+    def build(cls, aliases: List[str], n: int = 3, n_features: int = 2 ** 20) -> "NGramIndex":
+        """Builds index.
+        aliases (List[str]): Aliases to index.
+        n (int): Length of n-grams.
+        n_features (int): Number of features to hash n-grams into.
+        RETURNS (NGramIndex): Index.
+        """
+        rows: List[int] = []
+        cols: List[int] = []
+        counts: List[int] = []
+        for i, alias in enumerate(aliases):
+            ngram_counts = _count_ngrams(alias, n, n_features)
+            rows.extend([i] * len(ngram_counts))
+            cols.extend(ngram_counts.keys())
+            counts.extend(ngram_counts.values())
+        tf = sparse.csr_matrix(
+            (numpy.asarray(counts, dtype=numpy.float32), (rows, cols)), shape=(len(aliases), n_features)
+        )
+        tf.sum_duplicates()
+        df = numpy.bincount(tf.indices, minlength=n_features)
+        idf = (numpy.log((1 + len(aliases)) / (1 + df)) + 1).astype(numpy.float32)
+        tf.data *= idf[tf.indices]
+        norms = numpy.sqrt(numpy.asarray(tf.multiply(tf).sum(axis=1)).ravel())
+        alias_ngrams = sparse.diags(1 / numpy.where(norms == 0, 1, norms)).dot(tf).tocsr().astype(numpy.float32)
+        ngram_aliases = alias_ngrams.T.tocsr()
+
+        encoded = [alias.encode("utf-8") for alias in aliases]
+        return cls(
+            numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8),
+            numpy.concatenate([[0], numpy.cumsum([len(alias) for alias in encoded], dtype=numpy.int64)]),
+            idf,
+            (alias_ngrams.indptr, alias_ngrams.indices, alias_ngrams.data),
+            (ngram_aliases.indptr, ngram_aliases.indices, ngram_aliases.data),
+            n,
+        )
+
+    def save(self, path: Path, kb_fingerprint: str = "") -> None:
+        """Saves index to directory.
+        path (Path): Path to directory.
+        kb_fingerprint (str): Fingerprint of the KB the index was built from, see utils.fingerprint_files().
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        numpy.save(path / "alias_bytes.npy", self.alias_bytes)
+        numpy.save(path / "alias_offsets.npy", self.alias_offsets)
+        numpy.save(path / "idf.npy", self.idf)
+        for name, matrix in (("alias_ngrams", self.alias_ngrams), ("ngram_aliases", self.ngram_aliases)):
+            for part, array in zip(("indptr", "indices", "data"), matrix):
+                numpy.save(path / f"{name}_{part}.npy", array)
+        with open(path / "meta.json", "w") as file:
+            json.dump({"n": self.n, "kb_fingerprint": kb_fingerprint}, file)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "NGramIndex":
+        """Loads index from directory.
+        path (Path): Path to directory.
+        mmap (bool): Whether to memory-map the arrays instead of reading them into memory.
+        RETURNS (NGramIndex): Index.
+        """
+        mmap_mode = "r" if mmap else None
+        with open(path / "meta.json", "r") as file:
+            meta = json.load(file)
+
+        def load_array(name: str) -> numpy.ndarray:
+            # Indexing a numpy.memmap is slower than indexing a plain array viewing the same memory.
+            return numpy.load(path / f"{name}.npy", mmap_mode=mmap_mode).view(numpy.ndarray)
+
+        return cls(
+            load_array("alias_bytes"),
+            load_array("alias_offsets"),
+            load_array("idf"),
+            tuple(load_array(f"alias_ngrams_{part}") for part in ("indptr", "indices", "data")),  # type: ignore
+            tuple(load_array(f"ngram_aliases_{part}") for part in ("indptr", "indices", "data")),  # type: ignore
+            meta["n"],
+        )
+
+    def search(
+        self, text: str, k: int, similarity_cutoff: float = 0.0, max_postings: int = 0
+    ) -> List[Tuple[float, str]]:
+        """Finds the aliases most similar to text. Not thread-safe, as lookups share buffers.
+        text (str): Text to look up.
+        k (int): Max. number of aliases to return.
+        similarity_cutoff (float): Min. cosine similarity of aliases to text.
+        max_postings (int): Max. length of the posting lists of n-grams to collect aliases from. Lower values decrease
+            latency, but miss aliases sharing only common n-grams with text. If 0, the search is exact.
+        RETURNS (List[Tuple[float, str]]): Similarity and alias of the up to k most similar aliases with a similarity
+            of at least similarity_cutoff, from most to least similar.
+        """
+        ngram_counts = _count_ngrams(text, self.n, self.n_features)
+        if not ngram_counts or k <= 0:
+            return []
+        features = numpy.fromiter(ngram_counts.keys(), dtype=numpy.int64, count=len(ngram_counts))
+        weights = numpy.fromiter(ngram_counts.values(), dtype=numpy.float32, count=len(ngram_counts))
+        weights *= self.idf[features]
+        weights /= numpy.linalg.norm(weights)
+
+        # The posting lists are read from the rarest n-gram on, accumulating each alias's similarity and squared norm
+        # over the n-grams read so far. An alias not found in them can at most reach the norm of the remaining query
+        # weights, so new aliases are only collected until that drops below the cutoff and the k-th highest similarity
+        # accumulated so far, which is a lower bound for the k-th highest similarity. This is checked after groups of
+        # lists of doubling size, to check often for the rare n-grams without doing so after every list. With
+        # max_postings, aliases are also only collected up to the first n-gram with a longer posting list.
+        order = numpy.argsort(-weights, kind="stable")
+        features, weights = features[order], weights[order]
+        remaining_norms = numpy.append(numpy.sqrt(numpy.cumsum(weights[::-1] ** 2)[::-1]), 0).tolist()
+        scores, squared_norms, seen = self._buffers()
+        found: List[numpy.ndarray] = []
+        candidates = numpy.zeros(0, dtype=numpy.int64)
+
+        def collects(i: int) -> bool:
+            return i == 0 or not max_postings or self._n_postings(features[i]) <= max_postings
+
+        try:
+            n_read, group_size, min_score = 0, 1, similarity_cutoff
+            while n_read < len(features) and remaining_norms[n_read] >= min_score and collects(n_read):
+                group_end = n_read + 1
+                while group_end < min(n_read + group_size, len(features)) and collects(group_end):
+                    group_end += 1
+                for i in range(n_read, group_end):
+                    aliases, alias_weights = self._postings(features[i])
+                    new_aliases = aliases[~seen[aliases]]
+                    seen[new_aliases] = True
+                    found.append(new_aliases)
+                    scores[aliases] += alias_weights * weights[i]
+                    squared_norms[aliases] += alias_weights ** 2
+                n_read, group_size = group_end, group_size * 2
+                candidates = numpy.concatenate(found)
+                if len(candidates) >= k:
+                    min_score = max(min_score, float(numpy.partition(scores[candidates], len(candidates) - k)[-k]))
+
+            # The remaining n-grams can add at most the norm of their query weights times the norm of an alias's
+            # weights not read yet. The aliases that can still reach the min. similarity this way are scored exactly,
+            # unless reading the next posting list to tighten their bounds is cheaper.
+            passing = candidates
+            while n_read < len(features):
+                upper_bounds = scores[candidates] + remaining_norms[n_read] * numpy.sqrt(
+                    numpy.clip(1 - squared_norms[candidates], 0, None)
+                )
+                passing = candidates[upper_bounds >= min_score - 1e-6]
+                if len(passing) * _POSTINGS_PER_SCORING < self._n_postings(features[n_read]):
+                    break
+                aliases, alias_weights = self._postings(features[n_read])
+                # Aliases not found so far can't reach the min. similarity anymore (unless skipped due to max_postings).
+                found_mask = seen[aliases]
+                aliases, alias_weights = aliases[found_mask], alias_weights[found_mask]
+                scores[aliases] += alias_weights * weights[n_read]
+                squared_norms[aliases] += alias_weights ** 2
+                n_read += 1
+            else:
+                passing = candidates
+
+            if n_read < len(features):
+                sorter = numpy.argsort(features)
+                passing_scores = self._score(
+                    passing, features[sorter].astype(self.alias_ngrams[1].dtype), weights[sorter]
+                )
+            else:
+                passing_scores = scores[passing].astype(numpy.float64)
+        finally:
+            scores[candidates] = 0
+            squared_norms[candidates] = 0
+            seen[candidates] = False
+
+        above_cutoff = numpy.nonzero(passing_scores >= similarity_cutoff)[0]
+        if len(above_cutoff) > k:
+            above_cutoff = above_cutoff[numpy.argpartition(-passing_scores[above_cutoff], k - 1)[:k]]
+        above_cutoff = above_cutoff[numpy.argsort(-passing_scores[above_cutoff], kind="stable")]
+
+        return [(float(passing_scores[i]), self.alias(passing[i])) for i in above_cutoff]
+
+    def _buffers(self) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Returns the buffers for accumulating the similarity and squared norm and marking the aliases found during a
+        lookup. They're allocated once and reset after every lookup, which is cheaper than sorting the aliases found.
+        RETURNS (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]): Buffers with one entry per alias.
+        """
+        if self._scores is None:
+            self._scores = numpy.zeros(len(self), dtype=numpy.float32)
+            self._squared_norms = numpy.zeros(len(self), dtype=numpy.float32)
+            self._seen = numpy.zeros(len(self), dtype=bool)
+        return self._scores, self._squared_norms, self._seen
+
+    def _n_postings(self, feature: int) -> int:
+        """Returns length of feature's posting list.
+        feature (int): Feature.
+        RETURNS (int): Number of aliases containing feature.
+        """
+        indptr = self.ngram_aliases[0]
+        return int(indptr[feature + 1] - indptr[feature])
+
+    def _postings(self, feature: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Returns aliases in feature's posting list and their weights for it.
+        feature (int): Feature.
+        RETURNS (Tuple[numpy.ndarray, numpy.ndarray]): Alias indices and weights.
+        """
+        indptr, indices, data = self.ngram_aliases
+        start, end = indptr[feature], indptr[feature + 1]
+        return indices[start:end], data[start:end]
+
+    def _score(self, aliases: numpy.ndarray, features: numpy.ndarray, weights: numpy.ndarray) -> numpy.ndarray:
+        """Computes the cosine similarity of aliases to a query.
+        aliases (numpy.ndarray): Alias indices.
+        features (numpy.ndarray): Features of query, sorted.
+        weights (numpy.ndarray): Normalized TF-IDF weights of query's features.
+        RETURNS (numpy.ndarray): Similarity per alias.
+        """
+        row_idxs, alias_features, alias_weights = _gather_rows(self.alias_ngrams, aliases)
+        positions = numpy.searchsorted(features, alias_features).clip(max=len(features) - 1)
+        shared = features[positions] == alias_features
+
+        return numpy.bincount(
+            row_idxs[shared], weights=alias_weights[shared] * weights[positions[shared]], minlength=len(aliases)
+        )
+
+
+def load_index(path: Path, n_aliases: int, kb_fingerprint: str) -> Optional[NGramIndex]:
+    """Loads index from directory, if it exists and was built from the KB.
+    path (Path): Path to directory.
+    n_aliases (int): Number of aliases in KB.
+    kb_fingerprint (str): Fingerprint of KB, see utils.fingerprint_files().
+    RETURNS (Optional[NGramIndex]): Memory-mapped index, or None if there is no index matching the KB.
+    """
+    if not (path / "meta.json").exists():
+        return None
+    with open(path / "meta.json", "r") as file:
+        if json.load(file).get("kb_fingerprint") != kb_fingerprint:
+            return None
+    index = NGramIndex.load(path)
+
+    return index if len(index) == n_aliases else None
+
+
+def _count_ngrams(text: str, n: int, n_features: int) -> Counter:
+    """Counts hashed character n-grams of text.
+    text (str): Text.
+    n (int): Length of n-grams.
+    n_features (int): Number of features to hash n-grams into.
+    RETURNS (Counter): Count per feature.
+    """
+    # crc32 is stable across processes, unlike hash().
+    padded = f" {text.lower()} "
+    return Counter(
+        zlib.crc32(padded[i: i + n].encode("utf-8")) % n_features for i in range(max(0, len(padded) - n + 1))
+    )
+
+
+def _gather_rows(
+    matrix: Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray], rows: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Gathers the entries of several rows of a CSR matrix.
+    matrix (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]): indptr, indices and data of CSR matrix.
+    rows (numpy.ndarray): Row indices.
+    RETURNS (Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]): Position of each entry's row in rows, and column
+        index and value of each entry.
+    """
+    indptr, indices, data = matrix
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    row_idxs = numpy.repeat(numpy.arange(len(rows)), lengths)
+    # Position of every entry in indices/data: its row's start plus its offset within the row.
+    entry_idxs = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths) + numpy.arange(lengths.sum())
+
+    return row_idxs, indices[entry_idxs], data[entry_idxs]
@@ -5,8 +5,15 @@ from datasets.dataset import Dataset
 from wikid import read_filter_terms
 
 
-def main(dataset_name: str, language: str, use_filter_terms: bool = typer.Argument(False)):
-    """Create corpora in spaCy format.
+def main(
+    dataset_name: str,
+    language: str,
+    use_filter_terms: bool = typer.Argument(False),
+    n_process: int = typer.Option(1, help="Number of processes to create docs with. If -1, all cores are used."),
+    batch_size: int = typer.Option(100, help="Number of docs to send to a process at once."),
+    shard_size: int = typer.Option(1000, help="Max. number of docs per DocBin. If 0, one DocBin per corpus."),
+):
+    """Create corpora in spaCy format. Each of the train/dev/test corpora is written to a directory of DocBins.
     dataset_name (str): Dataset name.
     language (str): Language.
     use_filter_terms (bool): Whether to use the filter terms defined in the dataset config. If True, only documents
@@ -14,7 +21,9 @@ def main(dataset_name: str, language: str, use_filter_terms: bool = typer.Argume
         included.
     """
     # Run name isn't relevant for corpora compilation.
-    Dataset.generate_from_id(dataset_name, language).compile_corpora(read_filter_terms() if use_filter_terms else None)
+    Dataset.generate_from_id(dataset_name, language).compile_corpora(
+        read_filter_terms() if use_filter_terms else None, n_process, batch_size, shard_size
+    )
 
 
 if __name__ == "__main__":
@@ -1,27 +1,40 @@
 """ Custom functions to be hooked up into the registry. """
 from functools import partial
 
-from typing import Iterable, Callable
+from typing import Iterable, Callable, List
 import typing
 import spacy
 from spacy.kb import Candidate, KnowledgeBase
 from spacy.tokens import Span
 
+from scripts.candidate_generation import cache
 from scripts.candidate_generation import embeddings
 from scripts.candidate_generation import lexical
 
-embedding_candidate_selector = embeddings.EmbeddingCandidateSelector()
-fuzzy_lexical_candidate_selector = lexical.LexicalCandidateSelector()
+# Shared by all selectors. Cache keys include the selector and its config, so selectors don't share entries.
+candidate_cache = cache.CandidateCache()
+embedding_candidate_selector = embeddings.EmbeddingCandidateSelector(candidate_cache)
+fuzzy_lexical_candidate_selector = lexical.LexicalCandidateSelector(candidate_cache)
 
 
 @spacy.registry.misc("EmbeddingGetCandidates.v1")
 def create_candidates_via_embeddings(
-    dataset_name: str, language: str, max_n_candidates: int, lexical_similarity_cutoff: float
+    dataset_name: str,
+    language: str,
+    max_n_candidates: int,
+    lexical_similarity_cutoff: float,
+    n_probe: int = 0,
+    persist_cache: bool = False,
 ) -> Callable[[KnowledgeBase, Span], Iterable[Candidate]]:
     """Returns Callable for identification of candidates via their embeddings.
     dataset_name (str): Dataset name.
     langugage (str): Language.
     max_n_candidates (int): Numbers of nearest neighbours to query.
+    lexical_similarity_cutoff (float): Min. normalized Levenshtein similarity of a neighbour's alias to the span text.
+    n_probe (int): Number of clusters of the ANN index to search per span. Higher values increase recall and latency.
+        If 0, all entities are searched exactly.
+    persist_cache (bool): Whether to load cached candidates from and save them to disk, so that they are reused across
+        runs.
     RETURNS (Callable[[KnowledgeBase, Span], Iterable[Candidate]]): Callable for identification of entity candidates.
     """
 
@@ -34,19 +47,68 @@ def create_candidates_via_embeddings(
             language=language,
             max_n_candidates=max_n_candidates,
             lexical_similarity_cutoff=lexical_similarity_cutoff,
+            n_probe=n_probe,
+            persist_cache=persist_cache,
+        ),
+    )
+
+
+@spacy.registry.misc("EmbeddingGetCandidatesBatch.v1")
+def create_candidates_batch_via_embeddings(
+    dataset_name: str,
+    language: str,
+    max_n_candidates: int,
+    lexical_similarity_cutoff: float,
+    n_probe: int = 0,
+    persist_cache: bool = False,
+) -> Callable[[KnowledgeBase, Iterable[Span]], List[Iterable[Candidate]]]:
+    """Returns Callable for identification of candidates for several spans at once via their embeddings, with one
+    nearest neighbour query for all spans. Can be used as get_candidates_batch of the entity linker with spaCy >= 3.5.
+    dataset_name (str): Dataset name.
+    langugage (str): Language.
+    max_n_candidates (int): Numbers of nearest neighbours to query.
+    lexical_similarity_cutoff (float): Min. normalized Levenshtein similarity of a neighbour's alias to the span text.
+    n_probe (int): Number of clusters of the ANN index to search per span. Higher values increase recall and latency.
+        If 0, all entities are searched exactly.
+    persist_cache (bool): Whether to load cached candidates from and save them to disk, so that they are reused across
+        runs.
+    RETURNS (Callable[[KnowledgeBase, Iterable[Span]], List[Iterable[Candidate]]]): Callable for identification of
+        entity candidates.
+    """
+
+    return typing.cast(
+        Callable[[KnowledgeBase, Iterable[Span]], List[Iterable[Candidate]]],
+        partial(
+            embedding_candidate_selector.batch,
+            dataset_id=dataset_name,
+            language=language,
+            max_n_candidates=max_n_candidates,
+            lexical_similarity_cutoff=lexical_similarity_cutoff,
+            n_probe=n_probe,
+            persist_cache=persist_cache,
         ),
     )
 
 
 @spacy.registry.misc("FuzzyStringGetCandidates.v1")
 def create_candidates_via_fuzzy_string_matching(
-    dataset_name: str, language: str, max_n_candidates: int, similarity_cutoff: float
+    dataset_name: str,
+    language: str,
+    max_n_candidates: int,
+    similarity_cutoff: float,
+    max_postings: int = 0,
+    persist_cache: bool = False,
 ) -> Callable[[KnowledgeBase, Span], Iterable[Candidate]]:
     """Returns Callable for identification of candidates via NN search in lexical space.
     dataset_name (str): Dataset name.
     langugage (str): Language.
     max_n_candidates (int): Numbers of nearest neighbours to query.
     similarity_cutoff (float): Similarity value below which candidates won't be included.
+    max_postings (int): Max. number of aliases containing a character n-gram of the span for it to be used to find
+        candidate aliases. Lower values decrease latency, but miss aliases sharing only common n-grams with the span.
+        If 0, all aliases are searched exactly.
+    persist_cache (bool): Whether to load cached candidates from and save them to disk, so that they are reused across
+        runs.
     RETURNS (Callable[[KnowledgeBase, Span], Iterable[Candidate]]): Callable for identification of entity candidates.
     """
 
@@ -61,5 +123,7 @@ def create_candidates_via_fuzzy_string_matching(
             language=language,
             max_n_candidates=max_n_candidates,
             similarity_cutoff=similarity_cutoff,
+            max_postings=max_postings,
+            persist_cache=persist_cache,
         ),
     )
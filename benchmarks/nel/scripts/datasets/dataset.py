@@ -7,11 +7,11 @@ import inspect
 import operator
 import os
 import pickle
+import shutil
 from collections import defaultdict
 from pathlib import Path
-from typing import Tuple, Set, List, Optional, TypeVar, Type, Dict, Union
+from typing import Tuple, Set, List, Optional, TypeVar, Type, Dict, Union, Iterable, Iterator
 
-import numpy
 import prettytable
 import spacy
 import tqdm
@@ -21,10 +21,12 @@ from spacy.kb import KnowledgeBase
 from spacy.pipeline.legacy import EntityLinker_v1
 from spacy.tokens import Doc, DocBin
 from spacy.training import Example
+from spacy.vocab import Vocab
 from spacy.pipeline import EntityLinker
 
 from wikid import schemas
 from . import evaluation
+from .utils import create_spans_from_doc_annotation
 from utils import get_logger
 
 logger = get_logger(__name__)
@@ -34,6 +36,9 @@ DatasetType = TypeVar("DatasetType", bound="Dataset")
 class Dataset(abc.ABC):
     """Base class for all datasets used in this benchmark."""
 
+    # Directory in the corpora directory shards are written to before they're assigned to train, dev or test.
+    _STAGING_KEY = "unassigned"
+
     def __init__(self, run_name: str, language: str):
         """Initializes new Dataset.
         run_name (str): Run name.
@@ -53,7 +58,6 @@ class Dataset(abc.ABC):
         self._kb: Optional[KnowledgeBase] = None
         self._nlp_base: Optional[Language] = None
         self._nlp_best: Optional[Language] = None
-        self._annotated_docs: Optional[List[Doc]] = None
 
     @staticmethod
     def assemble_paths(dataset_name: str, run_name: str, language: str) -> Dict[str, Path]:
@@ -74,6 +78,9 @@ class Dataset(abc.ABC):
             "assets": assets_path,
             "nlp_base": wikid_path / language / "nlp",
             "kb": wikid_path / language / "kb",
+            "ann_index": wikid_path / language / "kb_ann_index",
+            "ngram_index": wikid_path / language / "kb_ngram_index",
+            "candidate_cache": wikid_path / language / "kb_candidate_cache.pkl",
             "entities": assets_path / "entities.pkl",
             "failed_entity_lookups": assets_path / "entities_failed_lookups.pkl",
             "annotations": assets_path / "annotations.pkl",
@@ -86,26 +93,73 @@ class Dataset(abc.ABC):
         """Returns dataset name."""
         raise NotImplementedError
 
-    def compile_corpora(self, filter_terms: Optional[Set[str]] = None) -> None:
-        """Creates train/dev/test corpora for dataset.
+    def compile_corpora(
+        self,
+        filter_terms: Optional[Set[str]] = None,
+        n_process: int = 1,
+        batch_size: int = 100,
+        shard_size: int = 1000,
+    ) -> None:
+        """Creates train/dev/test corpora for dataset. Docs are created in parallel and written to disk in shards as
+        soon as they are annotated, so that memory usage doesn't grow with the size of the corpus.
         filter_terms (Optional[Set[str]]): Set of filter terms. Only documents containing at least one of the specified
             terms will be included in corpora. If None, all documents are included.
+        n_process (int): Number of processes to create docs with. If -1, all available cores are used.
+        batch_size (int): Number of docs to send to a process at once.
+        shard_size (int): Max. number of docs per serialized DocBin. If 0, each corpus is written to a single DocBin.
         """
         self._load_resource("entities")
         self._load_resource("failed_entity_lookups")
         self._load_resource("annotations")
         self._load_resource("nlp_base")
         Doc.set_extension("overlapping_annotations", default=None)
-        self._annotated_docs = self._create_annotated_docs(filter_terms)
-        self._serialize_corpora()
+        self._serialize_corpora(self._create_annotated_docs(filter_terms, n_process, batch_size), shard_size)
+
+    def _read_doc_texts(self, filter_terms: Optional[Set[str]] = None) -> Iterator[Tuple[str, str]]:
+        """Reads texts of documents in corpus.
+        filter_terms (Optional[Set[str]]): Set of filter terms. Only documents containing at least one of the specified
+            terms will be included. If None, all documents are included.
+        RETURNS (Iterator[Tuple[str, str]]): Text and ID of each document, in the order of the corpus.
+        """
+        raise NotImplementedError
 
-    def _create_annotated_docs(self, filter_terms: Optional[Set[str]] = None) -> List[Doc]:
+    def _create_annotated_docs(
+        self, filter_terms: Optional[Set[str]] = None, n_process: int = 1, batch_size: int = 100
+    ) -> Iterator[Doc]:
         """Creates docs annotated with entities.
         filter_terms (Optional[Set[str]]): Set of filter terms. Only documents containing at least one of the specified
             terms will be included in corpora. If None, all documents are included.
-        RETURN (List[Doc]): List of docs reflecting all entity annotations.
+        n_process (int): Number of processes to create docs with. If -1, all available cores are used.
+        batch_size (int): Number of docs to send to a process at once.
+        RETURNS (Iterator[Doc]): Docs reflecting all entity annotations, in the order of the corpus.
         """
-        raise NotImplementedError
+        n_docs = 0
+        n_annots_available = 0
+        n_annots_assigned = 0
+
+        for doc, doc_id in tqdm.tqdm(
+            self._nlp_base.pipe(
+                self._read_doc_texts(filter_terms), as_tuples=True, n_process=n_process, batch_size=batch_size
+            ),
+            desc="Creating doc objects",
+            leave=False,
+        ):
+            doc_annots = self._annotations.get(doc_id, [])
+            doc.ents, _ = create_spans_from_doc_annotation(
+                doc=doc,
+                entities_info=self._entities,
+                annotations=doc_annots,
+                harmonize_with_doc_ents=True,
+            )
+            n_docs += 1
+            n_annots_available += len(doc_annots)
+            n_annots_assigned += len(doc.ents)
+            yield doc
+
+        logger.info(
+            f"Assigned {n_annots_assigned} out of {n_annots_available} annotations "
+            f"({(n_annots_assigned / max(1, n_annots_available) * 100):.2f}%) in {n_docs} docs."
+        )
 
     def parse_corpus(self, **kwargs) -> None:
         """Parses corpus. Loads data on entities and mentions.
@@ -141,8 +195,14 @@ class Dataset(abc.ABC):
         """
         raise NotImplementedError
 
-    def _serialize_corpora(self) -> None:
-        """Serializes corpora."""
+    def _serialize_corpora(self, docs: Iterable[Doc], shard_size: int = 1000) -> None:
+        """Serializes corpora. The docs are written to DocBins with at most shard_size docs each as they come in, so
+        that they're only read once. Once their number is known, the first docs are assigned to the train corpus, the
+        following ones to the dev corpus and the remaining ones to the test corpus, according to the configured
+        fractions: each shard is moved to the directory of its corpus, and only shards spanning two corpora are split.
+        docs (Iterable[Doc]): Docs to serialize.
+        shard_size (int): Max. number of docs per DocBin. If 0, each corpus is written to a single DocBin.
+        """
         assert (
             self._options["frac_train"]
             + self._options["frac_dev"]
@@ -150,30 +210,67 @@ class Dataset(abc.ABC):
             == 1
         )
 
-        indices = {
-            dataset: idx
-            for dataset, idx in zip(
-                ("train", "dev", "test"),
-                numpy.split(
-                    numpy.asarray(range(len(self._annotated_docs))),
-                    [
-                        int(self._options["frac_train"] * len(self._annotated_docs)),
-                        int(
-                            (self._options["frac_train"] + self._options["frac_dev"])
-                            * len(self._annotated_docs)
-                        ),
-                    ],
-                ),
-            )
-        }
+        for key in (self._STAGING_KEY, "train", "dev", "test"):
+            # Remove shards of previous runs, as they might not all be overwritten.
+            shutil.rmtree(self._paths["corpora"] / key, ignore_errors=True)
+            (self._paths["corpora"] / key).mkdir(parents=True)
+
+        shard_sizes: List[int] = []
+        shard = DocBin(store_user_data=True)
+        for doc in docs:
+            if shard_size and len(shard) == shard_size:
+                self._serialize_shard(shard, self._STAGING_KEY, len(shard_sizes))
+                shard_sizes.append(len(shard))
+                shard = DocBin(store_user_data=True)
+            shard.add(doc)
+        if len(shard):
+            self._serialize_shard(shard, self._STAGING_KEY, len(shard_sizes))
+            shard_sizes.append(len(shard))
+
+        n_docs = sum(shard_sizes)
+        train_end = int(self._options["frac_train"] * n_docs)
+        dev_end = int((self._options["frac_train"] + self._options["frac_dev"]) * n_docs)
+        ranges = {"train": (0, train_end), "dev": (train_end, dev_end), "test": (dev_end, n_docs)}
+        n_shards: Dict[str, int] = defaultdict(int)
+        shard_start = 0
+        for shard_idx, n_shard_docs in enumerate(shard_sizes):
+            shard_end = shard_start + n_shard_docs
+            shard_path = self._paths["corpora"] / self._STAGING_KEY / f"{shard_idx:04d}.spacy"
+            keys = [key for key, (start, end) in ranges.items() if start < shard_end and shard_start < end]
+            if len(keys) == 1:
+                shard_path.rename(self._paths["corpora"] / keys[0] / f"{n_shards[keys[0]]:04d}.spacy")
+                n_shards[keys[0]] += 1
+            else:
+                shard_docs = list(DocBin().from_disk(shard_path).get_docs(self._nlp_base.vocab))
+                for key in keys:
+                    start, end = ranges[key]
+                    part = shard_docs[max(start, shard_start) - shard_start: min(end, shard_end) - shard_start]
+                    self._serialize_shard(DocBin(store_user_data=True, docs=part), key, n_shards[key])
+                    n_shards[key] += 1
+            shard_start = shard_end
+        shutil.rmtree(self._paths["corpora"] / self._STAGING_KEY)
 
-        for key, idx in indices.items():
-            corpus = DocBin(store_user_data=True, docs=[self._annotated_docs[i] for i in idx])
-            if not self._paths["corpora"].exists():
-                self._paths["corpora"].mkdir()
-            corpus.to_disk(self._paths["corpora"] / f"{key}.spacy")
         logger.info(f"Completed serializing corpora at {self._paths['corpora']}.")
 
+    def _serialize_shard(self, shard: DocBin, key: str, shard_idx: int) -> None:
+        """Serializes shard of corpus, if it isn't empty.
+        shard (DocBin): Docs in shard.
+        key (str): Corpus the shard belongs to, i.e. one of ("train", "dev", "test"), or _STAGING_KEY.
+        shard_idx (int): Index of shard in corpus.
+        """
+        if len(shard):
+            shard.to_disk(self._paths["corpora"] / key / f"{shard_idx:04d}.spacy")
+
+    @staticmethod
+    def read_corpus(path: Path, vocab: Vocab) -> Iterator[Doc]:
+        """Reads docs from corpus serialized by compile_corpora().
+        path (Path): Path to corpus directory.
+        vocab (Vocab): Vocab to create docs with.
+        RETURNS (Iterator[Doc]): Docs in corpus, in the order they were serialized in.
+        """
+        for shard_path in sorted(path.glob("*.spacy"), key=lambda shard_path: int(shard_path.stem)):
+            yield from DocBin().from_disk(shard_path).get_docs(vocab)
+
     def _load_resource(self, key: str, force: bool = False) -> None:
         """Loads serialized resource.
         key (str): Resource key. Must be in self._paths.
@@ -225,8 +322,8 @@ class Dataset(abc.ABC):
                 self._nlp_best.config[setting] = value
 
         # Infer test set.
-        test_set_path = self._paths["corpora"] / "test.spacy"
-        docs = list(DocBin().from_disk(test_set_path).get_docs(self._nlp_best.vocab))
+        test_set_path = self._paths["corpora"] / "test"
+        docs = list(self.read_corpus(test_set_path, self._nlp_best.vocab))
         # spaCy sometimes includes leading articles in entities, our benchmark datasets don't. Hence we drop all
         # leading "the " and adjust the entity positions accordingly.
         for doc in docs:
@@ -246,7 +343,7 @@ class Dataset(abc.ABC):
                         total=len(docs)
                     )
                 ],
-                DocBin().from_disk(self._paths["corpora"] / "test.spacy").get_docs(self._nlp_best.vocab)
+                self.read_corpus(test_set_path, self._nlp_best.vocab)
             )
         ]
 
@@ -1,25 +1,57 @@
 """ Utilities for NEL benchmark. """
 
-from typing import Dict, List, Set, Tuple
+import bisect
+from typing import Dict, List, Optional, Set, Tuple
 import tqdm
-from spacy.tokens import Token, Span, Doc
+from spacy.tokens import Span, Doc
 from wikid import schemas, load_entities
 
 
-def _does_token_overlap_with_annotation(
-    token: Token, annot_start: int, annot_end: int
-) -> bool:
-    """Checks whether token overlaps with annotation span.
-    token (Token): Token to check.
+def _first_overlapping_token_start(
+    token_starts: List[int], token_ends: List[int], annot_start: int, annot_end: int
+) -> Optional[int]:
+    """Finds start index of first token overlapping with annotation span. A token overlaps with the span if it starts
+    within [annot_start, annot_end] or if annot_start is within [token start, token end].
+    token_starts (List[int]): Start index of each token in doc.
+    token_ends (List[int]): End index of each token in doc.
     annot_start (int): Annotation's start index.
     annot_end (int): Annotation's end index.
-    RETURNS (bool): Whether token overlaps with annotation span.
+    RETURNS (Optional[int]): Start index of first overlapping token, if there is one.
     """
 
-    return (
-        annot_start <= token.idx <= annot_end
-        or token.idx <= annot_start <= token.idx + len(token)
-    )
+    # Tokens containing annot_start start at or before it, so they precede all tokens starting within the span. As
+    # tokens don't overlap, their end indices are sorted too.
+    i = bisect.bisect_left(token_ends, annot_start)
+    if i < len(token_starts) and token_starts[i] <= annot_start:
+        return token_starts[i]
+    i = bisect.bisect_left(token_starts, annot_start)
+    if i < len(token_starts) and token_starts[i] <= annot_end:
+        return token_starts[i]
+
+    return None
+
+
+def _last_overlapping_token_end(
+    token_starts: List[int], token_ends: List[int], annot_start: int, annot_end: int
+) -> Optional[int]:
+    """Finds end index of last token overlapping with annotation span. A token overlaps with the span if it starts
+    within [annot_start, annot_end] or if annot_start is within [token start, token end].
+    token_starts (List[int]): Start index of each token in doc.
+    token_ends (List[int]): End index of each token in doc.
+    annot_start (int): Annotation's start index.
+    annot_end (int): Annotation's end index.
+    RETURNS (Optional[int]): End index of last overlapping token, if there is one.
+    """
+
+    # Tokens starting within the span follow all tokens containing annot_start.
+    i = bisect.bisect_right(token_starts, annot_end) - 1
+    if i >= 0 and token_starts[i] >= annot_start:
+        return token_ends[i]
+    i = bisect.bisect_right(token_starts, annot_start) - 1
+    if i >= 0 and token_ends[i] >= annot_start:
+        return token_ends[i]
+
+    return None
 
 
 def fetch_entity_information(
@@ -85,7 +117,12 @@ def create_spans_from_doc_annotation(
         for ent in doc.ents
     }
     doc_annots: List[schemas.Annotation] = []
+    # Start and end indices of accepted annotations, sorted.
+    annot_starts: List[int] = []
+    annot_ends: List[int] = []
     overlapping_doc_annotations: List[schemas.Annotation] = []
+    token_starts = [token.idx for token in doc]
+    token_ends = [token.idx + len(token) for token in doc]
 
     if harmonize_with_doc_ents and len(doc_ents_idx) == 0:
         return [], []
@@ -109,16 +146,12 @@ def create_spans_from_doc_annotation(
 
         # Indexing mistakes in the dataset might lead to wrong and/or overlapping annotations. We align the annotation
         # indices with spaCy's token indices to avoid at least some of these.
-        for token in doc:
-            if _does_token_overlap_with_annotation(token, annot.start_pos, annot.end_pos):
-                annot.start_pos = token.idx
-                break
-        for token in reversed([t for t in doc]):
-            if _does_token_overlap_with_annotation(
-                token, annot.start_pos, annot.end_pos - 1
-            ):
-                annot.end_pos = token.idx + len(token)
-                break
+        start_pos = _first_overlapping_token_start(token_starts, token_ends, annot.start_pos, annot.end_pos)
+        if start_pos is not None:
+            annot.start_pos = start_pos
+        end_pos = _last_overlapping_token_end(token_starts, token_ends, annot.start_pos, annot.end_pos - 1)
+        if end_pos is not None:
+            annot.end_pos = end_pos
 
         # After token alignment: filter with NER pipeline, if available.
         if harmonize_with_doc_ents and (annot.start_pos, annot.end_pos) not in doc_ents_idx:
@@ -126,18 +159,16 @@ def create_spans_from_doc_annotation(
 
         # If there is an overlap between annotation's start and end position and this token's parsed start
         # and end, we try to create a span with this token's position.
-        overlaps = False
         if count == -1:
             continue
-        for j in range(0, len(doc_annots)):
-            if not (
-                annot.end_pos < doc_annots[j].start_pos
-                or annot.start_pos > doc_annots[j].end_pos
-            ):
-                overlaps = True
-                overlapping_doc_annotations.append(annot)
-                break
-        if not overlaps:
+        # Accepted annotations don't overlap, so only the one starting last up to the annotation's end can overlap
+        # with it.
+        j = bisect.bisect_right(annot_starts, annot.end_pos) - 1
+        if j >= 0 and annot_ends[j] >= annot.start_pos:
+            overlapping_doc_annotations.append(annot)
+        else:
+            annot_starts.insert(j + 1, annot.start_pos)
+            annot_ends.insert(j + 1, annot.end_pos)
             doc_annots.append(annot)
 
     doc_spans = [
@@ -12,8 +12,8 @@ gpu_id="${6:--1}"
 PYTHONPATH=scripts python -m spacy train configs/$4 \
           --paths.dataset_name $1 \
           --output training/$1/$2 \
-          --paths.train corpora/$1/train.spacy \
-          --paths.dev corpora/$1/dev.spacy \
+          --paths.train corpora/$1/train \
+          --paths.dev corpora/$1/dev \
           --paths.kb wikid/output/$3/kb \
           --paths.base_nlp wikid/output/$3/nlp \
           --paths.language $3 \
@@ -1,5 +1,6 @@
 """ Various utils. """
 
+import hashlib
 import logging
 from pathlib import Path
 from typing import Set
@@ -18,3 +19,21 @@ def get_logger(handle: str) -> logging.Logger:
     """
 
     return logging.getLogger(handle)
+
+
+def fingerprint_files(*paths: Path) -> str:
+    """Fingerprints files by their names, sizes and modification times, without reading them. Directories are
+    fingerprinted by all files in them.
+    paths (Path): Paths to files or directories. Paths that don't exist are fingerprinted as missing.
+    RETURNS (str): Hex digest that changes whenever one of the files is written, added or removed.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        files = sorted(file for file in path.rglob("*") if file.is_file()) if path.is_dir() else [path]
+        for file in files:
+            # Only hash the names relative to the given paths, so moving the project doesn't change the fingerprint.
+            name = file.relative_to(path) if file != path else path.name
+            stat = file.stat() if file.exists() else None
+            digest.update(f"{name};{stat.st_size};{stat.st_mtime_ns}\n".encode() if stat else f"{name};\n".encode())
+
+    return digest.hexdigest()
@@ -25,6 +25,8 @@ def test_nel_benchmark():
     # Re-enable config overrides, if set before.
     if overrides:
         os.environ[overrides_key] = overrides
+    project_run(root, "build_ann_index", capture=True)
+    project_run(root, "build_ngram_index", capture=True)
     project_run(root, "parse_corpus", capture=True)
     project_run(root, "compile_corpora", capture=True)
     project_run(root, "train", capture=True, overrides={"vars.training_max_steps": 1, "vars.training_max_epochs": 1})
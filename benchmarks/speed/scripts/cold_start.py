@@ -0,0 +1,70 @@
+"""Measure the cold start of a model: the time it takes to import the library,
+load the model and process the first doc. Run as a script, it measures one
+cold start in the current (fresh) process and prints the numbers as JSON.
+Only modules that don't import any NLP library are imported at the top, so
+that the import time of the library being benchmarked isn't hidden.
+"""
+from typing import Dict, List
+import importlib
+import json
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+
+import typer
+
+# The modules each library needs before a model can be loaded
+LIBRARY_MODULES = {
+    "spacy": ["spacy"],
+    "stanza": ["stanza"],
+    "hf_trf": ["torch", "transformers"],
+    "flair": ["torch", "flair", "flair.models", "flair.tokenization"],
+    "ud_pipe": ["ufal.udpipe"],
+}
+
+
+def import_library(library: str) -> float:
+    """Import the modules of a library. Modules that are already imported cost
+    nothing, so this only measures the import time in a fresh process.
+    RETURNS (float): The seconds spent importing.
+    """
+    start = timeit.default_timer()
+    for module in LIBRARY_MODULES.get(library, []):
+        importlib.import_module(module)
+    return timeit.default_timer() - start
+
+
+def run_cold_starts(txt_dir: Path, library: str, name: str, gpu: bool, n_trials: int) -> List[Dict[str, float]]:
+    """Measure the cold start of a model n_trials times, each in a new process.
+    RETURNS (List[Dict[str, float]]): The import, load and first doc seconds of
+        every trial.
+    """
+    trials = []
+    for _ in range(n_trials):
+        cmd = [sys.executable, __file__, str(txt_dir), library, name, str(gpu)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, check=True, encoding="utf8")
+        # The library may print to stdout too: the numbers are on the last line
+        trials.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return trials
+
+
+def main(txt_dir: Path, library: str, name: str, gpu: bool):
+    import_seconds = import_library(library)
+    from data_reader import stream_data
+    from run_nlp import _get_run
+
+    start = timeit.default_timer()
+    nlp_function = _get_run(library, name, gpu)
+    load_seconds = timeit.default_timer() - start
+    # A batch of a single text, so this is the time to the first doc rather
+    # than to the first full batch
+    texts = list(stream_data(txt_dir, limit=1))
+    start = timeit.default_timer()
+    next(nlp_function(texts, 1))
+    first_doc_seconds = timeit.default_timer() - start
+    print(json.dumps({"import": import_seconds, "load": load_seconds, "first doc": first_doc_seconds}))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,82 @@
+from typing import Dict, Tuple
+import math
+from pathlib import Path
+
+import typer
+from wasabi import msg
+
+from summarize import GROUP_COLUMNS, read_results, summarize
+
+DEFAULT_METRICS = "steady k wps,p95 ms"
+# For all other metrics, higher is better
+LOWER_IS_BETTER = {"p50 ms", "p95 ms", "p99 ms", "peak rss mb"}
+
+
+def main(
+    baseline: Path,
+    current: Path,
+    tolerance: float = 0.05,
+    metrics: str = DEFAULT_METRICS,
+    run_id: str = "",
+):
+    """Compare the results.csv of the current benchmark against a baseline
+    results.csv, matching rows by library, model, GPU, batching and input
+    settings.
+    A metric regresses if it's worse than the baseline by more than the
+    relative tolerance (e.g. 0.05 for 5%). With several trials per side, the
+    gap also has to exceed the combined 95% confidence margins, so noise alone
+    doesn't fail the check. Exits with an error if any metric regressed. Pass a
+    run ID to only compare the rows of one run from the current results.
+    """
+    metric_names = [metric.strip() for metric in metrics.split(",")]
+    current_rows = read_results(current)
+    if run_id:
+        current_rows = [row for row in current_rows if row["run id"] == run_id]
+    baseline_stats = _index(summarize(read_results(baseline)))
+    current_stats = _index(summarize(current_rows))
+
+    header = ["Library", "Model", "GPU?", "Batch size", "# Processes", "Bucketing", "Stream?", "Shard"]
+    header += ["Max texts", "Warm-up batches", "Metric", "Baseline", "Current", "Change", "Status"]
+    table = []
+    n_regressions = 0
+    for key, metric in sorted(current_stats):
+        if metric not in metric_names:
+            continue
+        if (key, metric) not in baseline_stats:
+            msg.warn(f"No baseline for {' '.join(value for value in key[:2])} ({metric}): skipping")
+            continue
+        old = baseline_stats[(key, metric)]
+        new = current_stats[(key, metric)]
+        regressed = is_regression(old, new, tolerance, metric in LOWER_IS_BETTER)
+        n_regressions += regressed
+        change = (new["mean"] - old["mean"]) / old["mean"] if old["mean"] else 0.0
+        row = [value or "-" for value in key] + [metric, "%.1f" % old["mean"], "%.1f" % new["mean"]]
+        row += ["%+.1f%%" % (change * 100), "REGRESSION" if regressed else "ok"]
+        table.append(row)
+    if not table:
+        msg.fail(f"No rows of {current} match the baseline {baseline}", exits=1)
+    msg.table(table, header=header, divider=True)
+    if n_regressions:
+        msg.fail(f"{n_regressions} metric(s) regressed by more than {tolerance:.0%}", exits=1)
+    msg.good(f"No metric regressed by more than {tolerance:.0%}")
+
+
+def is_regression(old: Dict, new: Dict, tolerance: float, lower_is_better: bool) -> bool:
+    """Check whether the mean of a metric got worse than the tolerance allows,
+    by more than the combined confidence margins of both means."""
+    if lower_is_better:
+        gap = new["mean"] - old["mean"] * (1 + tolerance)
+    else:
+        gap = old["mean"] * (1 - tolerance) - new["mean"]
+    # A single trial has no confidence interval: its mean is all there is
+    margins = [stats["ci high"] - stats["mean"] for stats in (old, new)]
+    margin = math.sqrt(sum(m ** 2 for m in margins if math.isfinite(m)))
+    return gap > margin
+
+
+def _index(summary) -> Dict[Tuple[Tuple[str, ...], str], Dict]:
+    return {(tuple(stats[column] for column in GROUP_COLUMNS), stats["metric"]): stats for stats in summary}
+
+
+if __name__ == "__main__":
+    typer.run(main)
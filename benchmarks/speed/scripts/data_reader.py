@@ -1,8 +1,11 @@
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+import itertools
 import re
+import mmap
 from pathlib import Path
 import srsly
-from spacy.util import minibatch
+
+T = TypeVar("T")
 
 
 def read_data(txt_dir: Path, limit: int = 0) -> List[str]:
@@ -18,9 +21,80 @@ def read_data(txt_dir: Path, limit: int = 0) -> List[str]:
     return texts
 
 
-def rebatch_texts(texts, batch_size):
+def stream_data(
+    txt_dir: Path, limit: int = 0, shard: Tuple[int, int] = (0, 1), use_mmap: bool = False
+) -> Iterator[str]:
+    """Lazily yield the texts of read_data, one file and one record at a time.
+    Files are visited in sorted order so that shard i/n selects the same texts
+    in every process: the filtered texts are dealt round-robin over the shards.
+    """
+    shard_id, n_shards = shard
+    n_seen = 0
+    n_yielded = 0
+    for file in sorted(txt_dir.iterdir()):
+        for text in _read_file(file, use_mmap):
+            if len(text.split()) < 5:
+                continue
+            n_seen += 1
+            if (n_seen - 1) % n_shards != shard_id:
+                continue
+            yield text.strip()
+            n_yielded += 1
+            if limit and n_yielded >= limit:
+                return
+
+
+def _read_file(file: Path, use_mmap: bool) -> Iterator[str]:
+    is_jsonl = file.parts[-1].endswith("jsonl")
+    if not use_mmap:
+        if is_jsonl:
+            yield from (record["text"] for record in srsly.read_jsonl(file))
+        else:
+            yield file.read_text()
+        return
+    with file.open("rb") as f:
+        # Empty files can't be memory-mapped
+        if file.stat().st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if is_jsonl:
+                for line in iter(mm.readline, b""):
+                    line = line.strip()
+                    if line:
+                        yield srsly.json_loads(line)["text"]
+            else:
+                yield str(mm, "utf8")
+
+
+def minibatch(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Like spacy.util.minibatch, without importing spaCy: the benchmark
+    shouldn't pay for importing a library it may not be running."""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def sort_windows(
+    texts: Iterable[str], window_size: int, key: Callable[[str], int]
+) -> Iterator[Tuple[List[int], List[str]]]:
+    """Split the texts into windows of window_size texts, and sort the texts
+    of each window by the given length key, so that consecutive batches hold
+    texts of similar length. Yields (order, texts) tuples, where order[i] is
+    the position in the window of the i-th text after sorting.
+    """
+    for window in minibatch(texts, window_size):
+        order = sorted(range(len(window)), key=lambda i: key(window[i]))
+        yield order, [window[i] for i in order]
+
+
+def rebatch_texts(texts: Iterable[str], batch_size: int) -> Iterator[Tuple[List[str], str]]:
+    """Yield (batch, text) tuples: the texts of each batch, and the texts joined
+    into one document separated by blank lines."""
     newline_re = re.compile("\n+")
     for batch in minibatch(texts, size=batch_size):
-        batch = [newline_re.sub("\n", text) for text in batch]
-        batch = "\n\n".join(batch)
-        yield batch
+        joined = [newline_re.sub("\n", text) for text in batch]
+        joined = "\n\n".join(joined)
+        yield batch, joined
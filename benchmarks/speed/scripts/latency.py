@@ -0,0 +1,142 @@
+from typing import Dict, Iterable, Iterator, List, Tuple
+from array import array
+import timeit
+
+
+class LatencyHistogram:
+    """HDR-style histogram of latencies. Values are recorded in microseconds
+    into log-linear buckets: each power of two is split into 2**precision_bits
+    linear sub-buckets, so any recorded value can be reported with a relative
+    error below 2**-precision_bits, no matter how large the range of values.
+    """
+
+    def __init__(self, precision_bits: int = 7):
+        self.precision_bits = precision_bits
+        self.counts: Dict[Tuple[int, int], int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        micros = int(seconds * 1_000_000)
+        shift = max(0, micros.bit_length() - self.precision_bits - 1)
+        # (shift, mantissa) keys sort in the same order as the values they hold
+        key = (shift, micros >> shift)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percentile: float) -> float:
+        """Return the highest value (in seconds) in the bucket holding the given
+        percentile, capped at the largest value recorded."""
+        if not self.count:
+            return 0.0
+        rank = max(1, round(percentile / 100 * self.count))
+        seen = 0
+        for shift, mantissa in sorted(self.counts):
+            seen += self.counts[(shift, mantissa)]
+            if seen >= rank:
+                micros = ((mantissa + 1) << shift) - 1
+                return min(micros / 1_000_000, self.max)
+        return self.max
+
+
+class BatchTimer:
+    """Time every batch a runner yields, and record its size. The first
+    warmup_batches batches are excluded from the latency histogram and the
+    steady-state statistics, but are kept in the per-batch time series."""
+
+    def __init__(self, warmup_batches: int = 0):
+        self.warmup_batches = warmup_batches
+        self.histogram = LatencyHistogram()
+        self.batch_articles = array("q")
+        self.batch_words = array("q")
+        self.batch_seconds = array("d")
+        self.characters = 0
+        self.input_seconds = 0.0
+
+    def run(self, batches: Iterable[List[str]]):
+        """Consume the batches of texts yielded by a runner. Only the time spent
+        producing each batch is measured, not the time spent counting it, nor
+        the time spent reading texts passed through untimed()."""
+        batches = iter(batches)
+        while True:
+            input_seconds = self.input_seconds
+            start = timeit.default_timer()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            seconds = timeit.default_timer() - start
+            self.record(seconds - (self.input_seconds - input_seconds), batch)
+
+    def untimed(self, texts: Iterable[str]) -> Iterator[str]:
+        """Wrap the texts given to a runner, so that the time spent reading
+        them is excluded from the batches that pull them in. With a streamed
+        corpus, the texts are read from disk while the runner is timed."""
+        texts = iter(texts)
+        while True:
+            start = timeit.default_timer()
+            text = next(texts, None)
+            self.input_seconds += timeit.default_timer() - start
+            if text is None:
+                return
+            yield text
+
+    def record(self, seconds: float, texts: List[str]):
+        if len(self.batch_seconds) >= self.warmup_batches:
+            self.histogram.record(seconds)
+        self.batch_articles.append(len(texts))
+        self.batch_words.append(sum(len(text.split()) for text in texts))
+        self.batch_seconds.append(seconds)
+        self.characters += sum(len(text) for text in texts)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, float]]:
+        """Iterate over the (articles, words, seconds) of every batch."""
+        return zip(self.batch_articles, self.batch_words, self.batch_seconds)
+
+    @property
+    def articles(self) -> int:
+        return sum(self.batch_articles)
+
+    @property
+    def words(self) -> int:
+        return sum(self.batch_words)
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.batch_seconds)
+
+    @property
+    def steady_words(self) -> int:
+        return sum(self.batch_words[self.warmup_batches :])
+
+    @property
+    def steady_seconds(self) -> float:
+        return sum(self.batch_seconds[self.warmup_batches :])
+
+    @property
+    def latencies(self) -> LatencyHistogram:
+        """The histogram of the batches after the warm-up, or of all batches
+        if there are no batches left after the warm-up."""
+        if self.histogram.count:
+            return self.histogram
+        histogram = LatencyHistogram(self.histogram.precision_bits)
+        for seconds in self.batch_seconds:
+            histogram.record(seconds)
+        return histogram
+
+    @property
+    def steady_wps(self) -> float:
+        """Words per second after the warm-up, or over all batches if there
+        are no batches left after the warm-up."""
+        if self.steady_seconds:
+            return self.steady_words / self.steady_seconds
+        return self.words / self.seconds
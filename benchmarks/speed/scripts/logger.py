@@ -1,20 +1,89 @@
-from typing import Callable
+from typing import Callable, Dict, List, Optional
+import statistics
 from pathlib import Path
 from datetime import datetime
 from wasabi import msg
 
+from latency import BatchTimer
+from monitor import ResourceMonitor
+
+COLUMNS = [
+    "library",
+    "name",
+    "gpu",
+    "batch size",
+    "n process",
+    "bucketing",
+    "stream",
+    "shard",
+    "n texts",
+    "warmup batches",
+    "articles",
+    "characters",
+    "words",
+    "seconds",
+    "k wps",
+    "steady k wps",
+    "p50 ms",
+    "p95 ms",
+    "p99 ms",
+    "scaling efficiency",
+    "mean rss mb",
+    "peak rss mb",
+    "cpu utilization",
+    "k wps per gb",
+    "import s",
+    "load s",
+    "first batch s",
+    "run id",
+    "trial",
+    "time stamp",
+]
+BATCH_COLUMNS = [
+    "library",
+    "name",
+    "gpu",
+    "batch size",
+    "n process",
+    "bucketing",
+    "stream",
+    "shard",
+    "n texts",
+    "warmup batches",
+    "run id",
+    "trial",
+    "time stamp",
+    "batch",
+    "articles",
+    "words",
+    "seconds",
+]
+COMPONENT_COLUMNS = [
+    "library",
+    "name",
+    "gpu",
+    "batch size",
+    "articles",
+    "words",
+    "component",
+    "seconds",
+    "k wps",
+    "share",
+    "time stamp",
+]
+COLD_START_COLUMNS = ["library", "name", "gpu", "trial", "import s", "load s", "first doc s", "time stamp"]
+
 
 def create_logger(results_dir: Path) -> Callable:
     results_file = results_dir / "results.csv"
-    write_header = not results_file.exists()
-    with results_file.open("a", encoding="utf8") as f:
-        if write_header:
-            f.write(
-                "library;name;gpu;articles;characters;words;seconds;k wps;time stamp"
-            )
-            f.write("\n")
+    batches_file = results_dir / "batches.csv"
+    _write_header(results_file, COLUMNS)
+    _write_header(batches_file, BATCH_COLUMNS)
 
-    header = ["Library", "Model", "GPU?", "# Texts", "# Chars", "# Words", "# Seconds", "W/S", "Timestamp"]
+    header = ["Library", "Model", "GPU?", "Batch size", "# Processes", "Bucketing", "Stream?", "Shard", "Max texts"]
+    header += ["Warm-up batches", "# Texts", "# Chars", "# Words", "# Seconds", "W/S", "Steady W/S"]
+    header += ["p50 ms", "p95 ms", "p99 ms", "Efficiency", "Mean RSS MB", "Peak RSS MB", "CPU util", "W/S per GB"]
+    header += ["Import s", "Load s", "First batch s", "Run ID", "Trial", "Timestamp"]
     widths = [max(15, len(head)) for head in header]
     widths[-1] = len(str(datetime.now().isoformat(timespec="seconds")))
     msg.row(header, widths=widths)
@@ -22,20 +91,135 @@ def create_logger(results_dir: Path) -> Callable:
         library: str,
         name: str,
         gpu: bool,
-        articles: int,
-        characters: int,
-        words: int,
-        seconds: int,
+        batch_size: int,
+        n_process: int,
+        bucketing: str,
+        timer: BatchTimer,
+        monitor: ResourceMonitor,
+        import_seconds: float,
+        load_seconds: float,
+        efficiency: Optional[float] = None,
+        stream: bool = False,
+        shard: str = "",
+        n_texts: int = 0,
+        run_id: str = "",
+        trial: int = 0,
     ):
-        wps = words / seconds
+        seconds = timer.seconds
+        wps = timer.words / seconds
         wps = wps / 1000
+        if not timer.steady_seconds:
+            msg.warn(f"No batches left after the {timer.warmup_batches} warm-up batch(es)")
+        steady_wps = timer.steady_wps / 1000
+        percentiles = [timer.latencies.percentile(p) * 1000 for p in (50, 95, 99)]
+        mean_rss_mb = monitor.mean_rss / 1024 ** 2
+        peak_rss_mb = monitor.peak_rss / 1024 ** 2
+        # Throughput per GB of peak memory: what limits how many workers fit on a node
+        wps_per_gb = steady_wps / (peak_rss_mb / 1024)
 
         timestamp = datetime.now().isoformat(timespec="seconds")
-        row = [library, name, gpu, articles, characters, words, int(seconds), "%.1fk" % wps, timestamp]
+        settings = [stream, shard, n_texts, timer.warmup_batches]
+        row = [library, name, gpu, batch_size, n_process, bucketing or "-", stream, shard or "-", n_texts or "-"]
+        row += [timer.warmup_batches, timer.articles, timer.characters, timer.words, int(seconds)]
+        row += ["%.1fk" % wps, "%.1fk" % steady_wps] + ["%.1f" % ms for ms in percentiles]
+        row += ["" if efficiency is None else "%.2f" % efficiency, int(mean_rss_mb), int(peak_rss_mb)]
+        row += ["%.2f" % monitor.cpu_utilization, "%.1fk" % wps_per_gb]
+        # The time until the first batch is done: the time to the first doc is
+        # measured with a batch of one text by the cold start trials instead
+        first_batch_seconds = timer.batch_seconds[0]
+        row += ["%.2f" % import_seconds, "%.2f" % load_seconds, "%.2f" % first_batch_seconds, run_id, trial, timestamp]
         msg.row(data=row, widths=widths)
 
-        result = f"{library};{name};{gpu};{articles};{characters};{words};{seconds};{wps};{timestamp}"
+        result = [library, name, gpu, batch_size, n_process, bucketing] + settings
+        result += [timer.articles, timer.characters, timer.words, seconds]
+        result += [wps, steady_wps] + percentiles + ["" if efficiency is None else efficiency]
+        result += [mean_rss_mb, peak_rss_mb, monitor.cpu_utilization, wps_per_gb]
+        result += [import_seconds, load_seconds, first_batch_seconds, run_id, trial, timestamp]
         with results_file.open("a", encoding="utf8") as f:
-            f.write(result + "\n")
+            f.write(";".join(str(value) for value in result) + "\n")
+        # The time series of every batch goes to a sidecar file, linked to the
+        # row in results.csv by the settings, run ID, trial and time stamp
+        with batches_file.open("a", encoding="utf8") as f:
+            for i, (articles, words, batch_seconds) in enumerate(timer):
+                f.write(
+                    f"{library};{name};{gpu};{batch_size};{n_process};{bucketing};{stream};{shard};{n_texts};"
+                    f"{timer.warmup_batches};{run_id};{trial};{timestamp};{i};{articles};{words};{batch_seconds}\n"
+                )
 
     return log_result
+
+
+def create_component_logger(results_dir: Path) -> Callable:
+    """Log the time spent in each component of a pipeline to components.csv,
+    next to results.csv."""
+    components_file = results_dir / "components.csv"
+    _write_header(components_file, COMPONENT_COLUMNS)
+
+    header = ["Component", "# Seconds", "W/S", "Share"]
+    widths = [max(15, len(head)) for head in header]
+
+    def log_components(
+        library: str,
+        name: str,
+        gpu: bool,
+        batch_size: int,
+        articles: int,
+        words: int,
+        seconds: Dict[str, float],
+    ):
+        msg.info(f"Time per component for {library} model {name} on {articles} texts (GPU={gpu})")
+        msg.row(header, widths=widths)
+        total = sum(seconds.values())
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        with components_file.open("a", encoding="utf8") as f:
+            for component, component_seconds in list(seconds.items()) + [("total", total)]:
+                wps = words / component_seconds / 1000 if component_seconds else float("inf")
+                share = component_seconds / total if total else 0.0
+                row = [component, "%.2f" % component_seconds, "%.1fk" % wps, "%.1f%%" % (share * 100)]
+                msg.row(data=row, widths=widths)
+                result = [library, name, gpu, batch_size, articles, words, component, component_seconds, wps, share]
+                f.write(";".join(str(value) for value in result + [timestamp]) + "\n")
+
+    return log_components
+
+
+def create_cold_start_logger(results_dir: Path) -> Callable:
+    """Log the cold start trials of a model to cold_starts.csv, next to
+    results.csv."""
+    cold_starts_file = results_dir / "cold_starts.csv"
+    _write_header(cold_starts_file, COLD_START_COLUMNS)
+
+    header = ["Library", "Model", "GPU?", "# Trials", "Import s", "Load s", "First doc s", "Total s"]
+    widths = [max(15, len(head)) for head in header]
+
+    def log_cold_starts(library: str, name: str, gpu: bool, trials: List[Dict[str, float]]):
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        with cold_starts_file.open("a", encoding="utf8") as f:
+            for i, trial in enumerate(trials):
+                result = [library, name, gpu, i, trial["import"], trial["load"], trial["first doc"]]
+                f.write(";".join(str(value) for value in result + [timestamp]) + "\n")
+        # Report the medians, which are robust to the odd slow start
+        medians = [statistics.median(trial[key] for trial in trials) for key in ("import", "load", "first doc")]
+        msg.info("Median cold start")
+        msg.row(header, widths=widths)
+        row = [library, name, gpu, len(trials)] + ["%.2f" % seconds for seconds in medians + [sum(medians)]]
+        msg.row(data=row, widths=widths)
+
+    return log_cold_starts
+
+
+def _write_header(results_file: Path, columns):
+    header = ";".join(columns)
+    if results_file.exists():
+        with results_file.open("r", encoding="utf8") as f:
+            existing = f.readline().strip()
+        if existing != header:
+            msg.fail(
+                f"The columns of {results_file} don't match the current benchmark output: "
+                f"move the file away or remove it to start a new one.",
+                exits=1,
+            )
+        return
+    with results_file.open("w", encoding="utf8") as f:
+        f.write(header)
+        f.write("\n")
@@ -0,0 +1,74 @@
+from typing import Dict
+import threading
+import timeit
+import psutil
+
+DEFAULT_SAMPLE_INTERVAL = 0.1
+
+
+class ResourceMonitor:
+    """Context manager sampling the memory use and CPU time of this process
+    and all of its children on a background thread, so that the workers
+    started by e.g. nlp.pipe(n_process=...) are accounted for as well.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_rss = 0
+        self._rss_total = 0
+        self._n_samples = 0
+        self._process = psutil.Process()
+        # CPU seconds last seen per process ID, so that the time of children
+        # that exit before the end of the run is still included
+        self._cpu_seconds: Dict[int, float] = {}
+        self._cpu_start = 0.0
+        self._start = 0.0
+        self._end = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "ResourceMonitor":
+        self._sample()
+        self._cpu_start = sum(self._cpu_seconds.values())
+        self._start = timeit.default_timer()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        self._end = timeit.default_timer()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = 0
+        try:
+            processes = [self._process] + self._process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+                cpu_times = process.cpu_times()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            self._cpu_seconds[process.pid] = cpu_times.user + cpu_times.system
+        self.peak_rss = max(self.peak_rss, rss)
+        self._rss_total += rss
+        self._n_samples += 1
+
+    @property
+    def mean_rss(self) -> float:
+        return self._rss_total / self._n_samples if self._n_samples else 0.0
+
+    @property
+    def cpu_utilization(self) -> float:
+        """The average number of cores kept busy, e.g. 2.0 for 200% CPU."""
+        seconds = self._end - self._start
+        if not seconds:
+            return 0.0
+        return (sum(self._cpu_seconds.values()) - self._cpu_start) / seconds
@@ -1,18 +1,30 @@
-from typing import Callable, List
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
 
-import torch
 import typer
 import timeit
 import traceback
+import uuid
 from pathlib import Path
 import logging
 from wasabi import msg
 
-from data_reader import read_data, rebatch_texts
-from logger import create_logger
-from spacy.util import minibatch
+from cold_start import import_library, run_cold_starts
+from data_reader import read_data, stream_data, rebatch_texts, minibatch, sort_windows
+from latency import BatchTimer
+from monitor import ResourceMonitor
+from logger import create_logger, create_component_logger, create_cold_start_logger
 
 DEFAULT_BATCH_SIZE = 256
+DEFAULT_WARMUP_BATCHES = 1
+DEFAULT_BUCKET_WINDOW = 16
+# A runner takes the texts and the batch size, and yields the texts of every
+# batch once it's processed, so that each batch can be timed.
+Runner = Callable[[Iterable[str], int], Iterator[List[str]]]
+LENGTH_KEYS: Dict[str, Callable[[str], int]] = {
+    "chars": len,
+    "words": lambda text: len(text.split()),
+}
 
 
 def main(
@@ -23,43 +35,170 @@ def main(
     gpu: bool,
     batch_size: int = DEFAULT_BATCH_SIZE,
     n_texts: int = 0,
+    stream: bool = False,
+    shard: str = "",
+    mmap: bool = False,
+    warmup_batches: int = DEFAULT_WARMUP_BATCHES,
+    n_process: int = 1,
+    sweep_n_process: str = "",
+    sweep_batch_size: str = "",
+    profile_components: bool = False,
+    cold_starts: int = 0,
+    bucket_by: str = "",
+    bucket_window: int = DEFAULT_BUCKET_WINDOW,
+    run_id: str = "",
+    trial: int = 0,
 ):
-    try:
-        data = read_data(txt_dir, limit=n_texts)
-        articles = len(data)
+    """Time a model on the texts in txt_dir, batch by batch. With --stream, the
+    texts are read lazily while the model runs, so memory use doesn't grow with
+    the corpus size, and the time spent reading them isn't counted towards the
+    batches. --shard i/n then processes every n-th text starting from
+    the i-th, and --mmap memory-maps the input files. The first warmup_batches
+    batches are left out of the latency percentiles and the steady-state WPS.
+    --sweep-n-process and --sweep-batch-size take comma-separated values, and
+    run the model once for every combination of them, logging one row each.
+    --profile-components times each component of a spaCy pipeline separately
+    instead, and writes the breakdown to components.csv. --cold-starts N first
+    measures the import, load and first doc time of the model N times, each in
+    a fresh process, and writes them to cold_starts.csv. --bucket-by chars or
+    --bucket-by words sorts the texts by length within windows of bucket_window
+    batches, so that each batch holds texts of similar length. Every row is
+    tagged with the run ID (random unless given) and the trial number, see
+    run_trials.py.
+    """
+    if (shard or mmap) and not stream:
+        msg.fail("The --shard and --mmap options require --stream", exits=1)
+    if profile_components:
+        if library != "spacy":
+            msg.fail("--profile-components is only available for the spacy library", exits=1)
+        log_components = create_component_logger(result_dir)
+        data = _read_texts(txt_dir, n_texts, stream, shard, mmap)
+        articles, words, seconds = _profile_spacy_components(name, gpu, data, batch_size)
         if articles == 0:
             msg.fail(
-                f"Could not read any data from {txt_dir}: make sure a corpus of .txt files is available."
+                f"Could not read any data from {txt_dir}: make sure a corpus of .txt files is available.",
+                exits=1,
             )
-        chars = sum([len(d) for d in data])
-        words = sum([len(d.split()) for d in data])
-
-        nlp_function = _get_run(library, name, gpu)
-        start = timeit.default_timer()
-        nlp_function(data, batch_size)
-        end = timeit.default_timer()
-
-        log_run = create_logger(result_dir)
-        s = end - start
-        log_run(
+        log_components(
             library=library,
             name=name,
             gpu=gpu,
+            batch_size=batch_size,
             articles=articles,
-            characters=chars,
             words=words,
-            seconds=s,
+            seconds=seconds,
         )
-    # Usually we avoid these kind of long try-except blocks, but here we just want to ensure
-    # that the script can continue benchmarking the speed of other libraries if one fails
-    except Exception as e:
-        msg.info(f"Could not run model {name} with library {library} on GPU={gpu}:")
-        msg.info(traceback.format_exc())
+        return
+    n_processes = sorted(_parse_grid(sweep_n_process)) if sweep_n_process else [n_process]
+    batch_sizes = _parse_grid(sweep_batch_size) if sweep_batch_size else [batch_size]
+    if library != "spacy" and n_processes != [1]:
+        msg.fail(f"Library {library} doesn't support n_process > 1", exits=1)
+    if bucket_by and bucket_by not in LENGTH_KEYS:
+        msg.fail(f"Can't bucket by {bucket_by}: use one of {list(LENGTH_KEYS)}", exits=1)
+    bucketing = f"{bucket_by}/{bucket_window}" if bucket_by else ""
+    run_id = run_id or uuid.uuid4().hex[:8]
+    if cold_starts:
+        log_cold_starts = create_cold_start_logger(result_dir)
+        try:
+            trials = run_cold_starts(txt_dir, library, name, gpu, cold_starts)
+            log_cold_starts(library=library, name=name, gpu=gpu, trials=trials)
+        except Exception as e:
+            msg.info(f"Could not measure cold starts of model {name} with library {library} on GPU={gpu}:")
+            msg.info(traceback.format_exc())
+    log_run = create_logger(result_dir)
+    for config_batch_size in batch_sizes:
+        # Speed-ups are relative to the fewest processes run with this batch size
+        baseline: Optional[Tuple[int, float]] = None
+        for config_n_process in n_processes:
+            try:
+                data = _read_texts(txt_dir, n_texts, stream, shard, mmap)
+                # Only the first configuration pays for the imports
+                import_seconds = import_library(library)
+                start = timeit.default_timer()
+                nlp_function = _get_run(library, name, gpu, config_n_process)
+                load_seconds = timeit.default_timer() - start
+                if bucket_by:
+                    nlp_function = _bucketed(nlp_function, LENGTH_KEYS[bucket_by], bucket_window)
+                timer = BatchTimer(warmup_batches=warmup_batches)
+                if stream:
+                    # Time the model, not the file I/O of the streamed corpus
+                    data = timer.untimed(data)
+                with ResourceMonitor() as monitor:
+                    timer.run(nlp_function(data, config_batch_size))
+                if timer.articles == 0:
+                    msg.fail(
+                        f"Could not read any data from {txt_dir}: make sure a corpus of .txt files is available."
+                    )
+
+                if baseline is None:
+                    baseline = (config_n_process, timer.steady_wps)
+                base_n_process, base_wps = baseline
+                efficiency = None
+                if config_n_process == 1 or len(n_processes) > 1:
+                    speed_up = timer.steady_wps / base_wps
+                    efficiency = speed_up / (config_n_process / base_n_process)
+                log_run(
+                    library=library,
+                    name=name,
+                    gpu=gpu,
+                    batch_size=config_batch_size,
+                    n_process=config_n_process,
+                    bucketing=bucketing,
+                    timer=timer,
+                    monitor=monitor,
+                    import_seconds=import_seconds,
+                    load_seconds=load_seconds,
+                    efficiency=efficiency,
+                    stream=stream,
+                    shard=shard,
+                    n_texts=n_texts,
+                    run_id=run_id,
+                    trial=trial,
+                )
+            # Usually we avoid these kind of long try-except blocks, but here we just want to ensure
+            # that the script can continue benchmarking the speed of other libraries if one fails
+            except Exception as e:
+                msg.info(
+                    f"Could not run model {name} with library {library} on GPU={gpu} "
+                    f"(batch_size={config_batch_size}, n_process={config_n_process}):"
+                )
+                msg.info(traceback.format_exc())
+
+
+def _read_texts(txt_dir: Path, n_texts: int, stream: bool, shard: str, mmap: bool) -> Iterable[str]:
+    if stream:
+        return stream_data(txt_dir, limit=n_texts, shard=_parse_shard(shard), use_mmap=mmap)
+    return read_data(txt_dir, limit=n_texts)
+
+
+def _parse_grid(values: str) -> List[int]:
+    """Parse a comma-separated list of sweep values, e.g. "1,2,4,8"."""
+    try:
+        grid = [int(value) for value in values.split(",")]
+    except ValueError:
+        msg.fail(f"Invalid sweep values '{values}': expected integers separated by commas", exits=1)
+    if min(grid) < 1:
+        msg.fail(f"Invalid sweep values '{values}': all values should be positive", exits=1)
+    return grid
+
+
+def _parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a shard specification "i/n" into (i, n). An empty string means
+    a single shard holding all texts."""
+    if not shard:
+        return 0, 1
+    try:
+        shard_id, n_shards = (int(part) for part in shard.split("/"))
+    except ValueError:
+        msg.fail(f"Invalid shard '{shard}': expected the format i/n, e.g. 0/4", exits=1)
+    if not 0 <= shard_id < n_shards:
+        msg.fail(f"Invalid shard '{shard}': i must be in the range [0, n)", exits=1)
+    return shard_id, n_shards
 
 
-def _get_run(library: str, name: str, gpu: bool) -> Callable[[List[str]], None]:
+def _get_run(library: str, name: str, gpu: bool, n_process: int = 1) -> Runner:
     if library == "spacy":
-        return _run_spacy_model(name, gpu)
+        return _run_spacy_model(name, gpu, n_process)
 
     if library == "stanza":
         return _run_stanza_model(name, gpu)
@@ -80,21 +219,91 @@ def _get_run(library: str, name: str, gpu: bool) -> Callable[[List[str]], None]:
     )
 
 
-def _run_spacy_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
-    """Run a pretrained spaCy pipeline"""
+def _bucketed(runner: Runner, key: Callable[[str], int], window: int) -> Runner:
+    """Wrap a runner to process texts sorted by length within windows of
+    `window` batches, then restore the original order of each window. This
+    works for every runner, as it only reorders the texts it's given.
+    """
+
+    def run(texts: Iterable[str], batch_size: int):
+        orders: Deque[List[int]] = deque()
+
+        def sorted_texts():
+            for order, window_texts in sort_windows(texts, window * batch_size, key):
+                orders.append(order)
+                yield from window_texts
+
+        processed: List[str] = []
+        for batch in runner(sorted_texts(), batch_size):
+            processed.extend(batch)
+            yield batch
+            # The runners don't hand back their outputs, so the texts stand in
+            # for them: this accounts for the cost of restoring the order.
+            while orders and len(processed) >= len(orders[0]):
+                order = orders.popleft()
+                restored: List[Optional[str]] = [None] * len(order)
+                for position, text in zip(order, processed):
+                    restored[position] = text
+                processed = processed[len(order) :]
+
+    return run
+
+
+def _load_spacy_model(name: str, gpu: bool):
     import spacy
 
     if gpu:
         spacy.require_gpu(0)
-    nlp = spacy.load(name)
+    return spacy.load(name)
+
 
-    def run(texts: List[str], batch_size: int):
-        list(nlp.pipe(texts, batch_size=batch_size))
+def _run_spacy_model(name: str, gpu: bool, n_process: int = 1) -> Runner:
+    """Run a pretrained spaCy pipeline"""
+    nlp = _load_spacy_model(name, gpu)
+
+    def run(texts: Iterable[str], batch_size: int):
+        # Pass each text along as context, to report the texts of every batch
+        # without keeping the docs around: with a streamed corpus, memory use
+        # should stay flat no matter how many texts are processed.
+        docs = nlp.pipe(
+            ((text, text) for text in texts), batch_size=batch_size, n_process=n_process, as_tuples=True
+        )
+        for batch in minibatch(docs, batch_size):
+            yield [text for _, text in batch]
 
     return run
 
 
-def _run_transformer_model(name: str, gpu) -> Callable[[List[str]], None]:
+def _profile_spacy_components(
+    name: str, gpu: bool, texts: Iterable[str], batch_size: int
+) -> Tuple[int, int, Dict[str, float]]:
+    """Run a pretrained spaCy pipeline one component at a time: each batch is
+    tokenized with nlp.make_doc, then passed through every pipe in turn.
+    RETURNS (Tuple[int, int, Dict[str, float]]): The number of articles and
+        words, and the seconds spent in the tokenizer and in each pipe.
+    """
+    nlp = _load_spacy_model(name, gpu)
+    seconds = {"tokenizer": 0.0}
+    seconds.update({pipe_name: 0.0 for pipe_name in nlp.pipe_names})
+    articles = 0
+    words = 0
+    for batch in minibatch(texts, batch_size):
+        articles += len(batch)
+        words += sum(len(text.split()) for text in batch)
+        start = timeit.default_timer()
+        docs = [nlp.make_doc(text) for text in batch]
+        seconds["tokenizer"] += timeit.default_timer() - start
+        for pipe_name, proc in nlp.pipeline:
+            start = timeit.default_timer()
+            if hasattr(proc, "pipe"):
+                docs = list(proc.pipe(docs, batch_size=batch_size))
+            else:
+                docs = [proc(doc) for doc in docs]
+            seconds[pipe_name] += timeit.default_timer() - start
+    return articles, words, seconds
+
+
+def _run_transformer_model(name: str, gpu) -> Runner:
     """Run bare transformer model, outputting raw hidden-states"""
     from transformers import AutoTokenizer, AutoModel
     import torch
@@ -107,19 +316,20 @@ def _run_transformer_model(name: str, gpu) -> Callable[[List[str]], None]:
     if gpu:
         transformer = transformer.cuda()
 
-    def run(texts: List[str], batch_size: int):
+    def run(texts: Iterable[str], batch_size: int):
         transformer.eval()
         for batch in minibatch(texts, batch_size // 20):
-            batch = tokenizer(batch, padding=True, truncation=True, return_tensors="pt")
+            encoded = tokenizer(batch, padding=True, truncation=True, return_tensors="pt")
             if gpu:
-                batch["input_ids"] = batch["input_ids"].to("cuda:0")
-                batch["attention_mask"] = batch["attention_mask"].to("cuda:0")
-            transformer(**batch)
+                encoded["input_ids"] = encoded["input_ids"].to("cuda:0")
+                encoded["attention_mask"] = encoded["attention_mask"].to("cuda:0")
+            transformer(**encoded)
+            yield batch
 
     return run
 
 
-def _run_stanza_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
+def _run_stanza_model(name: str, gpu: bool) -> Runner:
     """Run a Stanza pretrained model"""
     import stanza
 
@@ -136,18 +346,20 @@ def _run_stanza_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
         depparse_batch_size=DEFAULT_BATCH_SIZE,
     )
 
-    def run(texts: List[str], batch_size: int):
+    def run(texts: Iterable[str], batch_size: int):
         # No batch parsing option available in Stanza I think? instead we have to
         # re-batch, concatenating with \n\n
-        for text in rebatch_texts(texts, batch_size):
+        for batch, text in rebatch_texts(texts, batch_size):
             nlp(text)
+            yield batch
 
     return run
 
 
-def _run_flair_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
+def _run_flair_model(name: str, gpu: bool) -> Runner:
     """Run a pretrained Flair pipeline"""
     import flair
+    import torch
     from flair.models import MultiTagger
     from flair.tokenization import SegtokSentenceSplitter
 
@@ -158,25 +370,26 @@ def _run_flair_model(name: str, gpu: bool) -> Callable[[List[str]], None]:
     tagger = MultiTagger.load(annot_list)
     splitter = SegtokSentenceSplitter()
 
-    def run(texts: List[str], batch_size: int):
+    def run(texts: Iterable[str], batch_size: int):
         # No batch parsing option available in Flair I think? instead we have to
         # re-batch, concatenating with \n\n
-        for text in rebatch_texts(texts, batch_size):
+        for batch, text in rebatch_texts(texts, batch_size):
             sentences = splitter.split(text)
             tagger.predict(sentences)
+            yield batch
 
     return run
 
 
-def _run_ud_pipe(name: str):
+def _run_ud_pipe(name: str) -> Runner:
     from ufal.udpipe import Model, Sentence
 
     model = Model.load(name)
     tokenizer = model.newTokenizer(model.DEFAULT)
 
-    def run(texts: List[str], batch_size: int):
+    def run(texts: Iterable[str], batch_size: int):
         # TODO: multi-document option?
-        for text in rebatch_texts(texts, batch_size):
+        for batch, text in rebatch_texts(texts, batch_size):
             tokenizer.setText(text)
             sentences = []
             sentence = Sentence()
@@ -186,6 +399,7 @@ def _run_ud_pipe(name: str):
             for s in sentences:
                 model.tag(s, model.DEFAULT)
                 model.parse(s, model.DEFAULT)
+            yield batch
 
     return run
 
@@ -0,0 +1,51 @@
+from pathlib import Path
+import random
+import subprocess
+import sys
+import uuid
+
+import typer
+from wasabi import msg
+
+from run_nlp import DEFAULT_BATCH_SIZE
+
+
+def main(
+    txt_dir: Path,
+    result_dir: Path,
+    models: str,
+    gpu: bool,
+    trials: int = 5,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    n_texts: int = 0,
+    seed: int = 0,
+):
+    """Time every model in `models` (comma-separated library:name pairs, e.g.
+    "spacy:en_core_web_sm,stanza:en_ewt") `trials` times. The runs are
+    interleaved: each round runs every model once, in a shuffled order, so
+    that noise from other jobs on the machine is spread over all models
+    instead of skewing the trials of a single one. All rows are logged to
+    results.csv with the same run ID; see summarize.py for the statistics.
+    """
+    specs = []
+    for spec in models.split(","):
+        if ":" not in spec:
+            msg.fail(f"Invalid model '{spec}': expected the format library:name", exits=1)
+        specs.append(spec.split(":", 1))
+    run_id = uuid.uuid4().hex[:8]
+    msg.info(f"Running {trials} trial(s) of {len(specs)} model(s) with run ID {run_id}")
+    run_nlp = Path(__file__).parent / "run_nlp.py"
+    rng = random.Random(seed)
+    for trial in range(trials):
+        order = list(specs)
+        rng.shuffle(order)
+        for library, name in order:
+            # A new process for every run, so one model doesn't warm up the next
+            cmd = [sys.executable, str(run_nlp), str(txt_dir), str(result_dir), library, name, str(gpu)]
+            cmd += ["--batch-size", str(batch_size), "--n-texts", str(n_texts)]
+            cmd += ["--run-id", run_id, "--trial", str(trial)]
+            subprocess.run(cmd)
+
+
+if __name__ == "__main__":
+    typer.run(main)
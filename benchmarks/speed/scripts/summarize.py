@@ -0,0 +1,98 @@
+from typing import Dict, Iterable, List, Tuple
+import csv
+import math
+import statistics
+from collections import defaultdict
+from pathlib import Path
+
+import typer
+from wasabi import msg
+
+# Rows with the same values for these columns are trials of the same benchmark
+GROUP_COLUMNS = ["library", "name", "gpu", "batch size", "n process", "bucketing"]
+GROUP_COLUMNS += ["stream", "shard", "n texts", "warmup batches"]
+METRICS = ["k wps", "steady k wps", "p50 ms", "p95 ms", "p99 ms", "peak rss mb"]
+SUMMARY_COLUMNS = GROUP_COLUMNS + ["trials", "metric", "mean", "stddev", "ci low", "ci high", "min", "max"]
+# Two-sided 97.5% quantiles of Student's t-distribution, by degrees of freedom
+T_QUANTILES = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228]
+T_QUANTILES += [2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086]
+T_QUANTILES += [2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def main(result_dir: Path, run_id: str = ""):
+    """Summarize the trials in results.csv: the mean, standard deviation, 95%
+    confidence interval of the mean, minimum and maximum of every metric, for
+    each library, model, GPU setting, batching configuration and input
+    setting (streaming, shard, number of texts and warm-up batches). Pass a
+    run ID to only summarize the trials of one run_trials.py invocation. The
+    summary is written to summary.csv.
+    """
+    rows = read_results(result_dir / "results.csv")
+    if run_id:
+        rows = [row for row in rows if row["run id"] == run_id]
+    if not rows:
+        msg.fail(f"No results to summarize in {result_dir}", exits=1)
+    summary = summarize(rows)
+    header = ["Library", "Model", "GPU?", "Batch size", "# Processes", "Bucketing", "Stream?", "Shard"]
+    header += ["Max texts", "Warm-up batches", "# Trials", "Metric", "Mean", "Stddev", "95% CI", "Min"]
+    table = []
+    for stats in summary:
+        row = [stats[column] or "-" for column in GROUP_COLUMNS] + [stats["trials"], stats["metric"]]
+        row += ["%.1f" % stats["mean"], "%.1f" % stats["stddev"]]
+        row += ["%.1f-%.1f" % (stats["ci low"], stats["ci high"]), "%.1f" % stats["min"]]
+        table.append(row)
+    msg.table(table, header=header, divider=True)
+    with (result_dir / "summary.csv").open("w", encoding="utf8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS, delimiter=";")
+        writer.writeheader()
+        writer.writerows(summary)
+
+
+def read_results(results_file: Path) -> List[Dict[str, str]]:
+    with results_file.open("r", encoding="utf8", newline="") as f:
+        return list(csv.DictReader(f, delimiter=";"))
+
+
+def summarize(rows: Iterable[Dict[str, str]]) -> List[Dict]:
+    """Compute the statistics of every metric per group of trials.
+    rows (Iterable[Dict[str, str]]): Rows of results.csv.
+    RETURNS (List[Dict]): One entry per group and metric, with the columns in
+        SUMMARY_COLUMNS.
+    """
+    groups: Dict[Tuple[str, ...], List[Dict[str, str]]] = defaultdict(list)
+    for row in rows:
+        groups[tuple(row[column] for column in GROUP_COLUMNS)].append(row)
+    summary = []
+    for key, trials in groups.items():
+        for metric in METRICS:
+            values = [float(trial[metric]) for trial in trials]
+            mean = statistics.mean(values)
+            stddev = statistics.stdev(values) if len(values) > 1 else 0.0
+            margin = confidence_margin(stddev, len(values))
+            stats = dict(zip(GROUP_COLUMNS, key))
+            stats.update(
+                {
+                    "trials": len(values),
+                    "metric": metric,
+                    "mean": mean,
+                    "stddev": stddev,
+                    "ci low": mean - margin,
+                    "ci high": mean + margin,
+                    "min": min(values),
+                    "max": max(values),
+                }
+            )
+            summary.append(stats)
+    return summary
+
+
+def confidence_margin(stddev: float, n: int) -> float:
+    """Half the width of the 95% confidence interval of a mean over n trials."""
+    if n < 2:
+        return math.inf
+    quantile = T_QUANTILES[n - 2] if n - 2 < len(T_QUANTILES) else 1.96
+    return quantile * stddev / math.sqrt(n)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,116 @@
+from typing import Deque, Dict, Hashable, Optional, Tuple
+from collections import deque
+import asyncio
+
+from .batching import DeadlineExceeded
+
+
+class Overloaded(Exception):
+    """Raised if a request can't be admitted because the queue is full."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too many queued requests, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _State:
+    # The articles and characters in flight for a key, and the queued
+    # requests waiting for them to go down, in order of arrival
+    def __init__(self):
+        self.articles = 0
+        self.characters = 0
+        self.waiters: Deque[Tuple[int, int, asyncio.Future]] = deque()
+
+
+class AdmissionController:
+    """Limit the articles and characters in flight per key, e.g. the model
+    (0 means no limit). Requests that would exceed the limits wait their turn
+    in a queue of up to max_queued requests (0 means no limit); once it's
+    full, new requests are rejected with Overloaded. A request larger than the
+    limits on its own is still admitted once nothing else is in flight.
+    """
+
+    def __init__(self, max_articles: int = 0, max_characters: int = 0, max_queued: int = 0, retry_after: float = 1):
+        self.max_articles = max_articles
+        self.max_characters = max_characters
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._states: Dict[Hashable, _State] = {}
+
+    async def acquire(
+        self,
+        key: Hashable,
+        n_articles: int,
+        n_characters: int,
+        deadline: Optional[float] = None,
+        reject: bool = True,
+    ):
+        """Wait until the request fits within the limits and count it as in
+        flight. Call release once it's processed.
+        deadline (Optional[float]): The event loop time by which the request
+            has to be admitted, or DeadlineExceeded is raised.
+        reject (bool): Raise Overloaded if the queue is full. Pass False for
+            requests that were already accepted, like the next chunk of a stream.
+        """
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            # Futures are bound to the loop they were created in
+            self._loop = loop
+            self._states = {}
+        state = self._states.setdefault(key, _State())
+        if not state.waiters and self._fits(state, n_articles, n_characters):
+            state.articles += n_articles
+            state.characters += n_characters
+            return
+        if reject and self.max_queued and len(state.waiters) >= self.max_queued:
+            raise Overloaded(self.retry_after)
+        timeout = deadline - loop.time() if deadline is not None else None
+        if timeout is not None and timeout <= 0:
+            raise DeadlineExceeded()
+        waiter = (n_articles, n_characters, loop.create_future())
+        state.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[2], timeout)
+        except BaseException as e:
+            if waiter[2].done() and not waiter[2].cancelled():
+                # Admitted just as it timed out or was cancelled
+                self.release(key, n_articles, n_characters)
+            elif waiter in state.waiters:
+                state.waiters.remove(waiter)
+                self._wake(state)
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded() from None
+            raise
+
+    def release(self, key: Hashable, n_articles: int, n_characters: int):
+        state = self._states.get(key)
+        if state is None:
+            return
+        state.articles -= n_articles
+        state.characters -= n_characters
+        self._wake(state)
+
+    def in_flight(self, key: Hashable) -> Tuple[int, int, int]:
+        """The articles and characters in flight and the queued requests."""
+        state = self._states.get(key, _State())
+        return state.articles, state.characters, len(state.waiters)
+
+    def _fits(self, state: _State, n_articles: int, n_characters: int) -> bool:
+        if not state.articles and not state.characters:
+            return True
+        if self.max_articles and state.articles + n_articles > self.max_articles:
+            return False
+        return not self.max_characters or state.characters + n_characters <= self.max_characters
+
+    def _wake(self, state: _State):
+        # Admit the queued requests in order, as long as they fit. Skip the
+        # ones that timed out or were cancelled but haven't resumed yet to
+        # remove themselves
+        while state.waiters and self._fits(state, *state.waiters[0][:2]):
+            n_articles, n_characters, future = state.waiters.popleft()
+            if future.done():
+                continue
+            state.articles += n_articles
+            state.characters += n_characters
+            future.set_result(None)
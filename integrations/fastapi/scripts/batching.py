@@ -0,0 +1,182 @@
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+from concurrent.futures import Executor
+import asyncio
+
+
+class DeadlineExceeded(Exception):
+    """Raised for requests that weren't processed before their deadline."""
+
+
+class BatchInfo(NamedTuple):
+    key: Hashable
+    n_requests: int
+    n_texts: int
+    n_characters: int
+    queue_seconds: List[float]  # Per request, from its submission to the batch start
+    seconds: float  # From the batch start until its results were returned
+    timings: Dict[str, float]  # Seconds per stage, as reported by the process function
+    worker: Any = None  # Report of the worker that processed the batch, if the process function returns one
+
+
+class _Request:
+    # The texts of one HTTP request, the future its results are set on, the
+    # time it was submitted and the loop time it has to start processing by
+    def __init__(self, texts: List[str], future: asyncio.Future, submitted: float, deadline: Optional[float]):
+        self.texts = texts
+        self.future = future
+        self.submitted = submitted
+        self.deadline = deadline
+
+
+class MicroBatcher:
+    """Coalesce concurrent requests with the same key, e.g. the model, into a
+    single call of the process function, so that many small requests share
+    the per-batch overhead of nlp.pipe. Each key has a worker that takes the
+    first queued request, waits for more until max_wait_ms after it arrived,
+    and processes them together once the batch holds max_batch_size texts or
+    the time is up. Requests are
+    never split: a request with more texts than max_batch_size is processed
+    on its own. Set max_batch_size to 1 to process every request separately.
+
+    Batches are run in the executor, the default thread pool if None. Up to
+    max_concurrency batches per key are processed at the same time, while
+    batches of different keys don't wait for each other. max_batches caps the
+    batches in flight over all keys (0 means no limit): with a process pool,
+    both should match its number of processes, so that batches never wait in
+    the pool's own queue, where they can't be coalesced or dropped. While no
+    slot is free, requests keep queueing up to form the next batches.
+
+    The process function returns the results for the texts and the seconds it
+    spent per stage, and optionally a report of the worker that ran it, e.g.
+    the models a worker process has loaded. These are passed on to the
+    listeners with a BatchInfo.
+    Requests that were cancelled or are past their deadline by the time their
+    batch starts are dropped before they reach the process function.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Hashable, List[str]], Tuple],
+        max_batch_size: int = 128,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+        max_concurrency: int = 1,
+        max_batches: int = 0,
+    ):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.max_batches = max_batches
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: Dict[Hashable, asyncio.Queue] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._slots: Dict[Hashable, asyncio.Semaphore] = {}
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._listeners: List[Callable[[BatchInfo], None]] = []
+
+    def add_listener(self, listener: Callable[[BatchInfo], None]):
+        """Call the listener with the info of every processed batch."""
+        self._listeners.append(listener)
+
+    async def submit(self, key: Hashable, texts: List[str], deadline: Optional[float] = None) -> List[Any]:
+        """Queue the texts to be processed with the given key, and wait for the
+        results of the batch they end up in.
+        deadline (Optional[float]): The event loop time by which processing has
+            to start, or DeadlineExceeded is raised.
+        RETURNS (List[Any]): The results for the texts, in order.
+        """
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            # Queues and tasks are bound to the loop they were created in
+            self._loop = loop
+            self._queues = {}
+            self._workers = {}
+            self._slots = {}
+            self._batch_slots = asyncio.Semaphore(self.max_batches) if self.max_batches else None
+        if key not in self._queues:
+            self._queues[key] = asyncio.Queue()
+            self._slots[key] = asyncio.Semaphore(self.max_concurrency)
+            self._workers[key] = loop.create_task(self._work(key))
+        future = loop.create_future()
+        await self._queues[key].put(_Request(texts, future, loop.time(), deadline))
+        return await future
+
+    async def _work(self, key: Hashable):
+        loop = asyncio.get_event_loop()
+        queue = self._queues[key]
+        carry: Optional[_Request] = None
+        while True:
+            first = carry if carry is not None else await queue.get()
+            carry = None
+            # Requests keep queueing while all slots are busy
+            await self._slots[key].acquire()
+            if self._batch_slots is not None:
+                await self._batch_slots.acquire()
+            batch = [first]
+            n_texts = len(first.texts)
+            # The wait starts when the first request arrived, not when a slot
+            # became free, so requests don't wait for a slot and then again
+            deadline = first.submitted + self.max_wait
+            while n_texts < self.max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout > 0:
+                        request = await asyncio.wait_for(queue.get(), timeout)
+                    else:
+                        request = queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if n_texts + len(request.texts) > self.max_batch_size:
+                    # Keep the batch within its size: this one starts the next
+                    carry = request
+                    break
+                batch.append(request)
+                n_texts += len(request.texts)
+            loop.create_task(self._run(key, batch))
+
+    async def _run(self, key: Hashable, batch: List[_Request]):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            batch = [request for request in batch if not self._drop(request, start)]
+            if not batch:
+                return
+            texts = [text for request in batch for text in request.texts]
+            # Run the CPU-bound processing in the executor, so the event loop
+            # can keep queueing requests in the meantime
+            output = await loop.run_in_executor(self.executor, self.process, key, texts)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._slots[key].release()
+            if self._batch_slots is not None:
+                self._batch_slots.release()
+        results, timings = output[:2]
+        offset = 0
+        for request in batch:
+            end = offset + len(request.texts)
+            # The client may have disconnected and its request been cancelled
+            if not request.future.done():
+                request.future.set_result(results[offset:end])
+            offset = end
+        queue_seconds = [start - request.submitted for request in batch]
+        n_characters = sum(len(text) for text in texts)
+        worker = output[2] if len(output) > 2 else None
+        seconds = loop.time() - start
+        info = BatchInfo(key, len(batch), len(texts), n_characters, queue_seconds, seconds, timings, worker)
+        for listener in self._listeners:
+            listener(info)
+
+    def _drop(self, request: _Request, now: float) -> bool:
+        # The client may have disconnected, or given up waiting
+        if request.future.done():
+            return True
+        if request.deadline is not None and now > request.deadline:
+            request.future.set_exception(DeadlineExceeded())
+            return True
+        return False
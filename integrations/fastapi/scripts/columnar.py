@@ -0,0 +1,50 @@
+from typing import Any, Dict, List
+from itertools import chain
+
+import numpy
+
+try:
+    # msgpack is optional, and only needed for the columnar format
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MEDIA_TYPES = ["application/x-msgpack", "application/msgpack"]
+# Columns of strings, encoded as IDs into a table of their distinct values
+STRING_COLUMNS = {"label", "pos", "tag", "dep"}
+
+
+def accepts_columnar(accept: str) -> bool:
+    """Check whether the Accept header of a request asks for msgpack."""
+    media_types = [media_type.split(";")[0].strip() for media_type in accept.split(",")]
+    return any(media_type in MEDIA_TYPES for media_type in media_types)
+
+
+def encode_columns(results: List[Dict[str, Dict[str, list]]]) -> bytes:
+    """Combine the columns extracted per doc into one struct of arrays per
+    table (e.g. "ents"), and encode them with msgpack. Every table has a "doc"
+    column with the index of the doc each row belongs to. Integer columns are
+    encoded as little-endian int32 arrays, so they can be decoded without
+    per-row overhead, e.g. with numpy.frombuffer(data, dtype="<i4"). Columns
+    of strings (STRING_COLUMNS), like the entity labels, are encoded the same
+    way as IDs into a table of the distinct strings, stored as "<column>_table".
+    """
+    tables: Dict[str, Dict[str, Any]] = {}
+    names = results[0].keys() if results else []
+    for name in names:
+        lengths = [len(next(iter(result[name].values()), [])) for result in results]
+        table = {"doc": _to_bytes(numpy.repeat(numpy.arange(len(results)), lengths))}
+        for column in results[0][name]:
+            values = list(chain.from_iterable(result[name][column] for result in results))
+            if column in STRING_COLUMNS:
+                strings, ids = numpy.unique(numpy.asarray(values, dtype=str), return_inverse=True)
+                table[column] = _to_bytes(ids)
+                table[f"{column}_table"] = strings.tolist()
+            else:
+                table[column] = _to_bytes(numpy.asarray(values))
+        tables[name] = table
+    return msgpack.packb({"n_docs": len(results), **tables}, use_bin_type=True)
+
+
+def _to_bytes(array: numpy.ndarray) -> bytes:
+    return array.astype("<i4").tobytes()
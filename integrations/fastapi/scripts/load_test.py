@@ -0,0 +1,197 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import defaultdict
+from pathlib import Path
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+import httpx
+import numpy
+import typer
+from wasabi import msg
+
+
+def main(
+    data_path: Path,
+    url: str = "",
+    spawn: bool = False,
+    host: str = "127.0.0.1",
+    port: int = 5001,
+    concurrency: int = 16,
+    n_requests: int = 500,
+    n_warmup: int = 20,
+    min_articles: int = 1,
+    max_articles: int = 16,
+    min_chars: int = 50,
+    max_chars: int = 2000,
+    models: str = "en_core_web_sm",
+    seed: int = 0,
+    output: Optional[Path] = None,
+):
+    """Load-test the /process/ endpoint with `concurrency` clients sending
+    `n_requests` requests as fast as they can, and report the throughput and
+    latency percentiles, overall and per model. By default, the app runs in
+    this process. Pass --spawn to start it with uvicorn on the given host and
+    port, or --url to test a server that's already running. The server is
+    configured with the usual environment variables.
+
+    The requests are generated up front from the texts in data_path (a JSONL
+    file with a "text" per line), so runs with the same seed send the same
+    requests. Every request has a uniformly random number of articles, with
+    lengths drawn log-uniformly between min_chars and max_chars. The models
+    are drawn by weight, e.g. "en_core_web_sm:0.8,en_core_web_md:0.2".
+    """
+    texts = [json.loads(line)["text"] for line in data_path.open("r", encoding="utf8") if line.strip()]
+    if not texts:
+        msg.fail(f"No texts found in {data_path}", exits=1)
+    rng = random.Random(seed)
+    model_weights = _parse_models(models)
+    requests = [
+        _make_request(rng, texts, model_weights, min_articles, max_articles, min_chars, max_chars)
+        for _ in range(n_warmup + n_requests)
+    ]
+    server = None
+    if spawn:
+        url = f"http://{host}:{port}"
+        server = _start_server(host, port)
+    try:
+        results, seconds = asyncio.run(_run(requests, n_warmup, concurrency, url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    report = _report(results, seconds)
+    header = ["Model", "Requests", "Errors", "Req/s", "Articles/s", "K chars/s", "P50 ms", "P95 ms", "P99 ms"]
+    table = []
+    for model, stats in report.items():
+        row = [model, stats["requests"], stats["errors"], "%.1f" % stats["requests_per_second"]]
+        row += ["%.1f" % stats["articles_per_second"], "%.1f" % (stats["characters_per_second"] / 1000)]
+        row += ["%.1f" % stats[f"p{q} ms"] for q in (50, 95, 99)]
+        table.append(row)
+    msg.table(table, header=header, divider=True)
+    if output is not None:
+        settings = {"concurrency": concurrency, "n_requests": n_requests, "models": models, "seed": seed}
+        with output.open("a", encoding="utf8") as f:
+            f.write(json.dumps({"settings": settings, "results": report}) + "\n")
+        msg.good(f"Appended the results to {output}")
+
+
+def _parse_models(models: str) -> List[Tuple[str, float]]:
+    weights = []
+    for spec in models.split(","):
+        name, _, weight = spec.partition(":")
+        weights.append((name.strip(), float(weight) if weight else 1.0))
+    return weights
+
+
+def _make_request(
+    rng: random.Random,
+    texts: List[str],
+    model_weights: List[Tuple[str, float]],
+    min_articles: int,
+    max_articles: int,
+    min_chars: int,
+    max_chars: int,
+) -> Dict[str, Any]:
+    model = rng.choices([name for name, _ in model_weights], weights=[w for _, w in model_weights])[0]
+    articles = []
+    for _ in range(rng.randint(min_articles, max_articles)):
+        n_chars = int(math.exp(rng.uniform(math.log(min_chars), math.log(max_chars))))
+        # Concatenate random texts until the article is long enough
+        text = rng.choice(texts)
+        while len(text) < n_chars:
+            text += " " + rng.choice(texts)
+        articles.append({"text": text[:n_chars]})
+    return {"articles": articles, "model": model}
+
+
+def _start_server(host: str, port: int) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "scripts.main:app", "--host", host, "--port", str(port)]
+    server = subprocess.Popen(cmd, cwd=Path(__file__).parent.parent)
+    start = timeit.default_timer()
+    while timeit.default_timer() - start < 300:
+        if server.poll() is not None:
+            msg.fail(f"The server exited with code {server.returncode}", exits=1)
+        try:
+            httpx.get(f"http://{host}:{port}/models")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.5)
+    server.terminate()
+    msg.fail(f"The server didn't start on {host}:{port}", exits=1)
+
+
+async def _run(
+    requests: List[Dict[str, Any]], n_warmup: int, concurrency: int, url: str
+) -> Tuple[List[Tuple[str, int, int, int, float]], float]:
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=None)
+        app = None
+    else:
+        from .main import app
+
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load-test", timeout=None)
+    results = []
+    try:
+        async with client:
+            # Warm up the models and batching before the timed requests
+            await _drive(client, requests[:n_warmup], concurrency, [])
+            start = timeit.default_timer()
+            await _drive(client, requests[n_warmup:], concurrency, results)
+            seconds = timeit.default_timer() - start
+    finally:
+        if app is not None:
+            await app.router.shutdown()
+    return results, seconds
+
+
+async def _drive(
+    client: httpx.AsyncClient,
+    requests: List[Dict[str, Any]],
+    concurrency: int,
+    results: List[Tuple[str, int, int, int, float]],
+):
+    queue = iter(requests)
+
+    async def worker():
+        # Every client sends its next request as soon as the last one returned
+        for request in queue:
+            n_chars = sum(len(article["text"]) for article in request["articles"])
+            start = timeit.default_timer()
+            response = await client.post("/process/", json=request)
+            seconds = timeit.default_timer() - start
+            results.append((request["model"], response.status_code, len(request["articles"]), n_chars, seconds))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+def _report(results: List[Tuple[str, int, int, int, float]], seconds: float) -> Dict[str, Dict[str, float]]:
+    by_model: Dict[str, List[Tuple[str, int, int, int, float]]] = defaultdict(list)
+    for result in results:
+        by_model[result[0]].append(result)
+    report = {}
+    for model, model_results in [("all", results)] + sorted(by_model.items()):
+        ok = [result for result in model_results if result[1] == 200]
+        latencies = [result[4] * 1000 for result in ok] or [0.0]
+        p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+        report[model] = {
+            "requests": len(model_results),
+            "errors": len(model_results) - len(ok),
+            "requests_per_second": len(ok) / seconds,
+            "articles_per_second": sum(result[2] for result in ok) / seconds,
+            "characters_per_second": sum(result[3] for result in ok) / seconds,
+            "p50 ms": p50,
+            "p95 ms": p95,
+            "p99 ms": p99,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,11 +1,36 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Deque, NamedTuple, Optional, Tuple
+from collections import deque
 from enum import Enum
-from fastapi import FastAPI
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import os
+import timeit
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import spacy
 from spacy.tokens import Doc
 
+from .admission import AdmissionController, Overloaded
+from .batching import BatchInfo, DeadlineExceeded, MicroBatcher
+from .cache import ResultCache
+from .columnar import accepts_columnar, encode_columns, msgpack
+from .metrics import Counter, Gauge, Histogram, render
+from .pipes import get_disabled_pipes
+from .registry import ModelEvent, ModelRegistry
+
+try:
+    # orjson is optional, but serializes the results of /process/stream faster
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class ModelName(str, Enum):
     # Enum of the available models. This allows the API to raise a more specific
@@ -16,10 +41,58 @@ class ModelName(str, Enum):
     en_core_web_trf = "en_core_web_trf"
 
 
+class Annotation(str, Enum):
+    # The annotations a request can ask for. Only the pipes needed to predict
+    # them are run, e.g. the parser is skipped if only entities are requested.
+    ents = "ents"
+    sents = "sents"
+    pos = "pos"
+    deps = "deps"
+
+
+# Requests are batched and their results cached by model, annotations and
+# response format ("json" or "columnar")
+Key = Tuple[str, Tuple[str, ...], str]
+
 DEFAULT_MODEL = ModelName.en_core_web_sm
 MODEL_NAMES = [model.value for model in ModelName]
-MODELS = {name: spacy.load(name) for name in MODEL_NAMES}
-print(f"Loaded {len(MODEL_NAMES)} models: {MODEL_NAMES}")
+# Models are loaded on their first request. Once more than MAX_LOADED_MODELS
+# models are loaded, or they take up more than MODEL_MEMORY_BUDGET_MB, the
+# least recently used ones are evicted (0 means no limit). The comma-separated
+# PRELOAD_MODELS are loaded on startup, so their first requests aren't slow.
+MAX_LOADED_MODELS = int(os.environ.get("MAX_LOADED_MODELS", 0))
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 0))
+PRELOAD_MODELS = [name for name in os.environ.get("PRELOAD_MODELS", DEFAULT_MODEL.value).split(",") if name]
+# With EXECUTION_BACKEND "thread", batches are processed in FastAPI's thread
+# pool, where the GIL keeps parsing to about one core. With "process", they're
+# sent to a pool of N_PROCESSES processes, each with its own model registry.
+EXECUTION_BACKEND = os.environ.get("EXECUTION_BACKEND", "thread")
+N_PROCESSES = int(os.environ.get("N_PROCESSES", os.cpu_count() or 1))
+# Concurrent requests for the same model are processed together: a batch is
+# sent to nlp.pipe once it holds MAX_BATCH_SIZE articles, or MAX_WAIT_MS after
+# its first request arrived. Set MAX_BATCH_SIZE to 1 to disable batching.
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 128))
+MAX_WAIT_MS = float(os.environ.get("MAX_WAIT_MS", 5))
+# Cache the results of up to RESULT_CACHE_SIZE texts per model, pipeline config
+# and annotations, for RESULT_CACHE_TTL seconds (0 means no expiry). Repeated
+# texts are answered from the cache without running the model. 0 disables it.
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 0))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 0))
+# Requests for a model are admitted while it has at most MAX_INFLIGHT_ARTICLES
+# articles and MAX_INFLIGHT_CHARACTERS characters in flight. Other requests
+# wait in a queue of up to MAX_QUEUED_REQUESTS, beyond which they're rejected
+# with a 503 and a Retry-After of RETRY_AFTER seconds. Requests larger than
+# MAX_REQUEST_ARTICLES or MAX_REQUEST_CHARACTERS are rejected with a 413.
+# Requests that haven't started processing after REQUEST_TIMEOUT seconds, or
+# the X-Request-Timeout header of the request, are dropped with a 504. For
+# all of these, 0 means no limit.
+MAX_INFLIGHT_ARTICLES = int(os.environ.get("MAX_INFLIGHT_ARTICLES", 0))
+MAX_INFLIGHT_CHARACTERS = int(os.environ.get("MAX_INFLIGHT_CHARACTERS", 0))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", 0))
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", 1))
+MAX_REQUEST_ARTICLES = int(os.environ.get("MAX_REQUEST_ARTICLES", 0))
+MAX_REQUEST_CHARACTERS = int(os.environ.get("MAX_REQUEST_CHARACTERS", 0))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 0))
 
 
 class Article(BaseModel):
@@ -30,11 +103,12 @@ class Article(BaseModel):
 class RequestModel(BaseModel):
     articles: List[Article]
     model: ModelName = DEFAULT_MODEL
+    annotations: List[Annotation] = [Annotation.ents]
 
 
 class ResponseModel(BaseModel):
     # This is the schema of the expected response and depends on what you
-    # return from get_data.
+    # return from get_data. Only the requested annotations are included.
 
     class Batch(BaseModel):
         class Entity(BaseModel):
@@ -42,46 +116,496 @@ class ResponseModel(BaseModel):
             start: int
             end: int
 
+        class Sentence(BaseModel):
+            start: int
+            end: int
+
+        class Token(BaseModel):
+            text: str
+            start: int
+            end: int
+            pos: Optional[str]
+            tag: Optional[str]
+            dep: Optional[str]
+            head: Optional[int]
+
         text: str
         ents: List[Entity] = []
+        sents: List[Sentence] = []
+        tokens: List[Token] = []
 
     result: List[Batch]
 
 
-def get_data(doc: Doc) -> Dict[str, Any]:
-    """Extract the data to return from the REST API given a Doc object. Modify
-    this function to include other data."""
-    ents = [
-        {
-            "text": ent.text,
-            "label": ent.label_,
-            "start": ent.start_char,
-            "end": ent.end_char,
+def get_data(doc: Doc, annotations: Tuple[str, ...]) -> Dict[str, Any]:
+    """Extract the requested annotations to return from the REST API given a
+    Doc object. Modify this function to include other data."""
+    data: Dict[str, Any] = {"text": doc.text}
+    if Annotation.ents in annotations:
+        # Shaped like the ResponseModel, so the results are returned as they
+        # are, without validating them
+        data["ents"] = [{"label": ent.label_, "start": ent.start_char, "end": ent.end_char} for ent in doc.ents]
+    if Annotation.sents in annotations:
+        data["sents"] = [{"start": sent.start_char, "end": sent.end_char} for sent in doc.sents]
+    if Annotation.pos in annotations or Annotation.deps in annotations:
+        data["tokens"] = []
+        for token in doc:
+            token_data = {"text": token.text, "start": token.idx, "end": token.idx + len(token)}
+            if Annotation.pos in annotations:
+                token_data.update({"pos": token.pos_, "tag": token.tag_})
+            if Annotation.deps in annotations:
+                token_data.update({"dep": token.dep_, "head": token.head.i})
+            data["tokens"].append(token_data)
+    return data
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf8")
+
+
+def encode_data(doc: Doc, annotations: Tuple[str, ...]) -> bytes:
+    """Extract the requested annotations of a Doc object with get_data, and
+    encode them as a JSON record of the response."""
+    return dumps(get_data(doc, annotations))
+
+
+def get_columns(doc: Doc, annotations: Tuple[str, ...]) -> Dict[str, Dict[str, list]]:
+    """Extract the requested annotations of a Doc object as columns, for the
+    columnar response format. Unlike get_data, this creates a list per column
+    rather than a dict per entity or token."""
+    columns: Dict[str, Dict[str, list]] = {}
+    if Annotation.ents in annotations:
+        ents = doc.ents
+        columns["ents"] = {
+            "start": [ent.start_char for ent in ents],
+            "end": [ent.end_char for ent in ents],
+            "label": [ent.label_ for ent in ents],
         }
-        for ent in doc.ents
-    ]
-    return {"text": doc.text, "ents": ents}
+    if Annotation.sents in annotations:
+        sents = list(doc.sents)
+        columns["sents"] = {"start": [sent.start_char for sent in sents], "end": [sent.end_char for sent in sents]}
+    if Annotation.pos in annotations or Annotation.deps in annotations:
+        columns["tokens"] = {"start": [token.idx for token in doc], "end": [token.idx + len(token) for token in doc]}
+        if Annotation.pos in annotations:
+            columns["tokens"]["pos"] = [token.pos_ for token in doc]
+            columns["tokens"]["tag"] = [token.tag_ for token in doc]
+        if Annotation.deps in annotations:
+            columns["tokens"]["dep"] = [token.dep_ for token in doc]
+            columns["tokens"]["head"] = [token.head.i for token in doc]
+    return columns
+
+
+class WorkerModels(NamedTuple):
+    # The models loaded in a worker process of the process backend, and its
+    # load and eviction events since it last reported them
+    pid: int
+    loaded: Dict[str, float]
+    events: List[ModelEvent]
+
+
+def log_model_event(event: ModelEvent):
+    verb = "Loaded" if event.kind == "load" else "Evicted"
+    print(f"{verb} model {event.model} ({event.size_mb:.0f} MB)")
+
+
+registry = ModelRegistry(max_models=MAX_LOADED_MODELS, memory_budget_mb=MODEL_MEMORY_BUDGET_MB)
+registry.add_listener(log_model_event)
+registry.preload(PRELOAD_MODELS)
+# Set in the worker processes of the process backend, which report their
+# model events to the server with the results of their batches
+is_worker = False
+unreported_events: List[ModelEvent] = []
+
+
+@lru_cache(maxsize=None)
+def get_disabled(model: str, annotations: Tuple[str, ...]) -> List[str]:
+    """The pipes of the model that the annotations don't need, cached per
+    model and combination of annotations."""
+    return get_disabled_pipes(registry.get(model), annotations)
+
+
+def process_texts(key: Key, texts: List[str]) -> Tuple[List[Any], Dict[str, float]]:
+    """Process a batch of texts with the given model, running only the pipes
+    needed for the annotations, and extract the data to return for each of
+    them: a JSON record encoded by encode_data, or the columns of get_columns
+    for the columnar format. The records are encoded here, in the executor,
+    so the event loop only has to join them. Also returns the seconds spent
+    in nlp.pipe and in extracting the data, and in a worker process of the
+    process backend, the models it has loaded."""
+    model, annotations, response_format = key
+    disable = get_disabled(model, annotations)
+    nlp = registry.get(model)
+    extract = get_columns if response_format == "columnar" else encode_data
+    stage = "get_columns" if response_format == "columnar" else "get_data"
+    timings = {"pipe": 0.0, stage: 0.0}
+    results = []
+    docs = nlp.pipe(texts, disable=disable)
+    while True:
+        start = timeit.default_timer()
+        doc = next(docs, None)
+        timings["pipe"] += timeit.default_timer() - start
+        if doc is None:
+            break
+        start = timeit.default_timer()
+        results.append(extract(doc, annotations))
+        timings[stage] += timeit.default_timer() - start
+    return results, timings, get_worker_models()
+
+
+def warm_up(names: List[str]):
+    """Load the preloaded models in a worker process. Forked workers inherit
+    the models loaded by the server, so this only loads what's missing."""
+    global is_worker
+    is_worker = True
+    registry.add_listener(unreported_events.append)
+    registry.preload(names)
+
+
+def get_worker_models() -> Optional[WorkerModels]:
+    """Report the models loaded in this worker process, and its model events
+    since the last report. Returns None in the server process."""
+    if not is_worker:
+        return None
+    events = list(unreported_events)
+    unreported_events.clear()
+    return WorkerModels(os.getpid(), registry.loaded, events)
+
+
+def get_config_hash(model: str) -> str:
+    """Hash the config and version of the model, so that cached results of an
+    updated model aren't reused. Installed packages and model directories are
+    hashed from their files, so that the server doesn't need to load models
+    whose batches are processed by worker processes."""
+    if spacy.util.is_package(model):
+        package_path = spacy.util.get_package_path(model)
+        meta = spacy.util.get_model_meta(package_path)
+        path = package_path / f"{meta['lang']}_{meta['name']}-{meta['version']}"
+    else:
+        path = Path(model)
+    if (path / "config.cfg").exists() and (path / "meta.json").exists():
+        meta = spacy.util.get_model_meta(path)
+        config = (path / "config.cfg").read_text("utf8") + meta.get("version", "")
+    else:
+        nlp = registry.get(model)
+        config = nlp.config.to_str() + nlp.meta.get("version", "")
+    return hashlib.sha1(config.encode("utf8")).hexdigest()
+
+
+# The metrics served at /metrics, in the Prometheus text format
+REQUEST_SECONDS = Histogram(
+    "spacy_api_request_duration_seconds",
+    "Latency of the requests (until the first byte for streams).",
+    labels=["path", "model", "status"],
+)
+IN_FLIGHT = Gauge("spacy_api_requests_in_flight", "Requests currently being handled.")
+DOCS = Counter("spacy_api_docs_processed_total", "Texts processed by the models.", labels=["model"])
+CHARACTERS = Counter("spacy_api_characters_processed_total", "Characters processed by the models.", labels=["model"])
+BATCH_SIZE = Histogram(
+    "spacy_api_batch_size", "Texts per batch.", labels=["model"], buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+)
+QUEUE_SECONDS = Histogram("spacy_api_queue_seconds", "Time requests waited for their batch to start.", labels=["model"])
+STAGE_SECONDS = Histogram(
+    "spacy_api_batch_stage_seconds",
+    "Time per batch in nlp.pipe and get_data or get_columns.",
+    labels=["model", "stage"],
+)
+REJECTED = Counter(
+    "spacy_api_rejected_requests_total", "Requests rejected by admission control.", labels=["model", "reason"]
+)
+ADMITTED_CHARACTERS = Gauge("spacy_api_admitted_characters", "Characters admitted and in flight.", labels=["model"])
+QUEUED = Gauge("spacy_api_queued_requests", "Requests waiting to be admitted.", labels=["model"])
+METRICS = [REQUEST_SECONDS, IN_FLIGHT, DOCS, CHARACTERS, BATCH_SIZE, QUEUE_SECONDS, STAGE_SECONDS]
+METRICS += [REJECTED, ADMITTED_CHARACTERS, QUEUED]
+
+
+def record_batch(info: BatchInfo):
+    model = info.key[0]
+    DOCS.inc(info.n_texts, model=model)
+    CHARACTERS.inc(info.n_characters, model=model)
+    BATCH_SIZE.observe(info.n_texts, model=model)
+    for seconds in info.queue_seconds:
+        QUEUE_SECONDS.observe(seconds, model=model)
+    for stage, seconds in info.timings.items():
+        STAGE_SECONDS.observe(seconds, model=model, stage=stage)
+
 
+# The models loaded in the worker processes by process ID, and their most
+# recent load and eviction events, as reported with their batches
+worker_models: Dict[int, Dict[str, float]] = {}
+worker_events: Deque[Dict[str, Any]] = deque(maxlen=registry.events.maxlen)
+
+
+def record_worker_models(report: Optional[WorkerModels]):
+    if report is None:
+        return
+    worker_models[report.pid] = report.loaded
+    worker_events.extend(dict(event._asdict(), pid=report.pid) for event in report.events)
+
+
+def record_batch_worker(info: BatchInfo):
+    record_worker_models(info.worker)
+
+
+batcher = MicroBatcher(process_texts, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS)
+batcher.add_listener(record_batch)
+batcher.add_listener(record_batch_worker)
+cache = ResultCache(RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL) if RESULT_CACHE_SIZE else None
+config_hashes: Dict[str, str] = {}
+admission = AdmissionController(
+    max_articles=MAX_INFLIGHT_ARTICLES,
+    max_characters=MAX_INFLIGHT_CHARACTERS,
+    max_queued=MAX_QUEUED_REQUESTS,
+    retry_after=RETRY_AFTER,
+)
+
+
+async def start_processing(
+    key: Key, texts: List[str], deadline: Optional[float], reject: bool = True
+) -> asyncio.Future:
+    """Wait for the texts to be admitted and start processing them. Returns
+    the task with the results, which releases the admission once it's done,
+    even if the client disconnected in the meantime."""
+    model = key[0]
+    n_characters = sum(len(text) for text in texts)
+    await admission.acquire(model, len(texts), n_characters, deadline=deadline, reject=reject)
+
+    async def process() -> List[Any]:
+        try:
+            return await process_cached(key, texts, deadline)
+        finally:
+            admission.release(model, len(texts), n_characters)
+
+    return asyncio.ensure_future(process())
+
+
+async def process_cached(key: Key, texts: List[str], deadline: Optional[float] = None) -> List[Any]:
+    """Answer the texts from the result cache where possible, and process only
+    the missing ones (each distinct text once). The results are in order."""
+    if cache is None:
+        return await batcher.submit(key, texts, deadline=deadline)
+    model = key[0]
+    if model not in config_hashes:
+        # Loading the model may take a while: don't block the event loop
+        loop = asyncio.get_event_loop()
+        config_hashes[model] = await loop.run_in_executor(None, get_config_hash, model)
+    prefix = (config_hashes[model],) + key
+    text_hashes = [hashlib.sha1(text.encode("utf8")).digest() for text in texts]
+    results = [cache.get(prefix + (text_hash,)) for text_hash in text_hashes]
+    missing: Dict[bytes, str] = {}
+    for text, text_hash, result in zip(texts, text_hashes, results):
+        if result is None:
+            missing.setdefault(text_hash, text)
+    if not missing:
+        return results
+    processed = dict(zip(missing, await batcher.submit(key, list(missing.values()), deadline=deadline)))
+    for text_hash, result in processed.items():
+        cache.set(prefix + (text_hash,), result)
+    return [processed[text_hash] if result is None else result for text_hash, result in zip(text_hashes, results)]
 
 # Set up the FastAPI app and define the endpoints
 app = FastAPI()
 app.add_middleware(CORSMiddleware, allow_origins=["*"])
 
 
-@app.get("/models", summary="List all loaded models")
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    IN_FLIGHT.inc()
+    start = timeit.default_timer()
+    try:
+        response = await call_next(request)
+    finally:
+        IN_FLIGHT.dec()
+    # Only label known endpoints, so unknown paths don't create new series
+    paths = {route.path for route in app.routes}
+    path = request.url.path if request.url.path in paths else "other"
+    # The processing endpoints set the model of the request
+    model = getattr(request.state, "model", "")
+    seconds = timeit.default_timer() - start
+    REQUEST_SECONDS.observe(seconds, path=path, model=model, status=str(response.status_code))
+    return response
+
+
+@app.on_event("startup")
+def start_process_pool():
+    if EXECUTION_BACKEND == "process":
+        pool = ProcessPoolExecutor(N_PROCESSES, initializer=warm_up, initargs=(PRELOAD_MODELS,))
+        # Start and warm up all processes now rather than on the first requests
+        for future in [pool.submit(get_worker_models) for _ in range(N_PROCESSES)]:
+            record_worker_models(future.result())
+        batcher.executor = pool
+        batcher.max_concurrency = N_PROCESSES
+        batcher.max_batches = N_PROCESSES
+        print(f"Started {N_PROCESSES} worker processes")
+    elif EXECUTION_BACKEND != "thread":
+        raise ValueError(f"Unknown EXECUTION_BACKEND {EXECUTION_BACKEND}: use 'thread' or 'process'")
+
+
+@app.on_event("shutdown")
+def stop_process_pool():
+    if batcher.executor is not None:
+        batcher.executor.shutdown()
+
+
+@app.get("/models", summary="List all available models")
 def get_models() -> List[str]:
-    """Return a list of all available loaded models."""
+    """Return a list of all available models, loaded or not."""
     return MODEL_NAMES
 
 
-@app.post("/process/", summary="Process batches of text", response_model=ResponseModel)
-def process_articles(query: RequestModel):
-    """Process a batch of articles and return the entities predicted by the
-    given model. Each record in the data should have a key "text".
+@app.get("/models/loaded", summary="List the loaded models")
+def get_loaded_models() -> Dict[str, float]:
+    """Return the currently loaded models and their estimated sizes in MB,
+    from the least to the most recently used. With the process backend, these
+    are the models loaded in any worker process as of its last batch, with
+    their sizes summed over the processes."""
+    if batcher.executor is None:
+        return registry.loaded
+    loaded: Dict[str, float] = {}
+    for models in worker_models.values():
+        for name, size_mb in models.items():
+            loaded[name] = loaded.get(name, 0.0) + size_mb
+    return loaded
+
+
+@app.get("/models/events", summary="List recent model loads and evictions")
+def get_model_events() -> List[Dict[str, Any]]:
+    """Return the most recent model load and eviction events. With the process
+    backend, the events of the worker processes follow those of the server,
+    and have the "pid" of their process. They're reported with the results of
+    the processes' batches."""
+    return [event._asdict() for event in registry.events] + list(worker_events)
+
+
+@app.get("/metrics", summary="Show the metrics in the Prometheus format", response_class=PlainTextResponse)
+def get_metrics():
+    """Return the request latencies, in-flight requests, processed texts and
+    characters, batch sizes, queue times and time spent in nlp.pipe and
+    get_data, in the Prometheus text format."""
+    for model in MODEL_NAMES:
+        _, n_characters, n_queued = admission.in_flight(model)
+        ADMITTED_CHARACTERS.set(n_characters, model=model)
+        QUEUED.set(n_queued, model=model)
+    return PlainTextResponse(render(METRICS), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache", summary="Show the result cache statistics")
+def get_cache_stats() -> Dict[str, Any]:
+    """Return the size, hits, misses and hit rate of the result cache, or
+    nothing if it's disabled."""
+    return cache.stats if cache is not None else {}
+
+
+def get_key(query: RequestModel, response_format: str = "json") -> Key:
+    """The model, annotations and response format of a request, which requests
+    are batched by."""
+    annotations = tuple(sorted(annotation.value for annotation in set(query.annotations)))
+    return (query.model.value, annotations, response_format)
+
+
+def check_request(query: RequestModel, request: Request) -> Optional[float]:
+    """Check the size limits of the request and return its deadline as an
+    event loop time, if it has a timeout."""
+    model = query.model.value
+    request.state.model = model
+    n_characters = sum(len(article.text) for article in query.articles)
+    if (MAX_REQUEST_ARTICLES and len(query.articles) > MAX_REQUEST_ARTICLES) or (
+        MAX_REQUEST_CHARACTERS and n_characters > MAX_REQUEST_CHARACTERS
+    ):
+        REJECTED.inc(model=model, reason="too_large")
+        raise HTTPException(
+            status_code=413,
+            detail=f"Requests are limited to {MAX_REQUEST_ARTICLES or 'any number of'} articles "
+            f"and {MAX_REQUEST_CHARACTERS or 'any number of'} characters",
+        )
+    timeout = REQUEST_TIMEOUT
+    if "X-Request-Timeout" in request.headers:
+        try:
+            timeout = float(request.headers["X-Request-Timeout"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout should be a number of seconds")
+    return asyncio.get_event_loop().time() + timeout if timeout else None
+
+
+@contextmanager
+def handle_admission(model: str):
+    """Turn requests rejected by admission control into HTTP errors."""
+    try:
+        yield
+    except Overloaded as e:
+        REJECTED.inc(model=model, reason="overloaded")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded:
+        REJECTED.inc(model=model, reason="deadline")
+        raise HTTPException(status_code=504, detail="The request wasn't processed before its timeout")
+
+
+@app.post(
+    "/process/",
+    summary="Process batches of text",
+    response_model=ResponseModel,
+    response_model_exclude_unset=True,
+)
+async def process_articles(query: RequestModel, request: Request):
+    """Process a batch of articles and return the annotations predicted by the
+    given model, the entities by default. Each record in the data should have
+    a key "text". Concurrent requests for the same model and annotations are
+    batched together behind the scenes. If the Accept header asks for msgpack
+    (application/x-msgpack), the annotations are returned in the columnar
+    format instead: see encode_columns for its layout.
     """
-    nlp = MODELS[query.model]
-    response_body = []
-    texts = (article.text for article in query.articles)
-    for doc in nlp.pipe(texts):
-        response_body.append(get_data(doc))
-    return {"result": response_body}
+    deadline = check_request(query, request)
+    columnar = accepts_columnar(request.headers.get("Accept", ""))
+    if columnar and msgpack is None:
+        raise HTTPException(status_code=406, detail="The columnar format requires msgpack to be installed")
+    texts = [article.text for article in query.articles]
+    with handle_admission(query.model.value):
+        pending = await start_processing(get_key(query, "columnar" if columnar else "json"), texts, deadline)
+        response_body = await pending
+    if columnar:
+        # Skips the validation and JSON encoding of the response model. The
+        # columns of all docs are combined in the thread pool, so a large
+        # response doesn't block the event loop.
+        loop = asyncio.get_event_loop()
+        body = await loop.run_in_executor(None, encode_columns, response_body)
+        return Response(body, media_type="application/x-msgpack")
+    # The records are already shaped like the response model and encoded
+    return Response(b'{"result":[' + b",".join(response_body) + b"]}", media_type="application/json")
+
+
+@app.post("/process/stream", summary="Process batches of text and stream the results")
+async def process_articles_stream(query: RequestModel, request: Request):
+    """Process a batch of articles like /process/, but stream the results as
+    newline-delimited JSON: one line per article, in order. The articles are
+    processed in chunks of MAX_BATCH_SIZE, and each chunk is sent as soon as
+    it's done, so large batches aren't held in memory as a whole. Each line
+    is a record of the ResponseModel's result, though it isn't validated
+    against it. Admission control and the
+    timeout apply to the first chunk: once the stream started, it's finished.
+    """
+    deadline = check_request(query, request)
+    key = get_key(query)
+    texts = [article.text for article in query.articles]
+    size = max(1, MAX_BATCH_SIZE)
+    chunks = [texts[i : i + size] for i in range(0, len(texts), size)]
+    pending = None
+    if chunks:
+        with handle_admission(query.model.value):
+            pending = await start_processing(key, chunks[0], deadline)
+    return StreamingResponse(stream_results(key, chunks, pending), media_type="application/x-ndjson")
+
+
+async def stream_results(key: Key, chunks: List[List[str]], pending: Optional[asyncio.Future]) -> AsyncIterator[bytes]:
+    if pending is None:
+        return
+    try:
+        for i in range(len(chunks)):
+            results = await pending
+            if i + 1 < len(chunks):
+                # Process the next chunk while the results of the current one are sent
+                pending = await start_processing(key, chunks[i + 1], None, reject=False)
+            yield b"".join(record + b"\n" for record in results)
+    finally:
+        # The client may have disconnected before all chunks were sent
+        pending.cancel()
@@ -0,0 +1,34 @@
+from typing import Iterable, List, Set
+
+from spacy.language import Language
+
+# The attributes each annotation of the API is read from. A pipe is needed if
+# it assigns any of them, according to its component meta.
+ANNOTATION_ATTRS = {
+    "ents": ["doc.ents"],
+    "sents": ["doc.sents", "token.is_sent_start"],
+    "pos": ["token.pos", "token.tag"],
+    "deps": ["token.dep", "token.head"],
+}
+
+
+def get_disabled_pipes(nlp: Language, annotations: Iterable[str]) -> List[str]:
+    """Find the pipes that don't need to run to predict the annotations, e.g.
+    the tagger and parser if only the entities are needed. Walking back from
+    the end of the pipeline, a pipe is kept if it assigns a needed attribute,
+    if a kept pipe requires one of its attributes, or if a kept pipe listens
+    to it (a shared tok2vec or transformer). Pipes that don't declare what
+    they assign, like the attribute_ruler, are always kept.
+    RETURNS (List[str]): The names of the pipes to pass to nlp.pipe(disable=...).
+    """
+    needed: Set[str] = set()
+    for annotation in annotations:
+        needed.update(ANNOTATION_ATTRS[annotation])
+    kept: Set[str] = set()
+    for name, pipe in reversed(nlp.pipeline):
+        meta = nlp.get_pipe_meta(name)
+        listeners = getattr(pipe, "listening_components", [])
+        if not meta.assigns or needed.intersection(meta.assigns) or kept.intersection(listeners):
+            kept.add(name)
+            needed.update(meta.requires)
+    return [name for name in nlp.pipe_names if name not in kept]
@@ -0,0 +1,109 @@
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Tuple
+from collections import OrderedDict, deque
+from datetime import datetime
+import gc
+import threading
+import timeit
+
+import psutil
+import spacy
+from spacy.language import Language
+
+
+class ModelEvent(NamedTuple):
+    kind: str  # "load" or "evict"
+    model: str
+    size_mb: float
+    seconds: float
+    timestamp: str
+
+
+class ModelRegistry:
+    """Load models on first use, and keep the most recently used ones in
+    memory. Once more than max_models models are loaded, or their estimated
+    memory use exceeds memory_budget_mb, the least recently used models are
+    evicted (0 means no limit). The most recently loaded model is never
+    evicted, even if it exceeds the budget on its own. The memory use of a
+    model is estimated as the growth of the process' RSS while loading it.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Language] = spacy.load,
+        max_models: int = 0,
+        memory_budget_mb: float = 0,
+        n_events: int = 100,
+    ):
+        self.loader = loader
+        self.max_models = max_models
+        self.memory_budget_mb = memory_budget_mb
+        self.events: Deque[ModelEvent] = deque(maxlen=n_events)
+        self._listeners: List[Callable[[ModelEvent], None]] = []
+        self._models: "OrderedDict[str, Tuple[Language, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._process = psutil.Process()
+
+    def add_listener(self, listener: Callable[[ModelEvent], None]):
+        """Call the listener with every load and eviction event."""
+        self._listeners.append(listener)
+
+    def preload(self, names: Iterable[str]):
+        for name in names:
+            self.get(name)
+
+    def get(self, name: str) -> Language:
+        """Return the model, loading it if needed. Thread-safe: concurrent
+        requests for a model that isn't loaded yet wait for a single load."""
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name][0]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name][0]
+            rss = self._process.memory_info().rss
+            start = timeit.default_timer()
+            nlp = self.loader(name)
+            seconds = timeit.default_timer() - start
+            size_mb = max(0, self._process.memory_info().rss - rss) / 1024 ** 2
+            with self._lock:
+                self._models[name] = (nlp, size_mb)
+                evicted = self._evict()
+            self._emit("load", name, size_mb, seconds)
+            for evicted_name, evicted_size_mb in evicted:
+                self._emit("evict", evicted_name, evicted_size_mb, 0.0)
+            if evicted:
+                # Requests still using an evicted model keep it alive until they're done
+                gc.collect()
+            return nlp
+
+    @property
+    def loaded(self) -> Dict[str, float]:
+        """The loaded models and their estimated sizes in MB, from the least
+        to the most recently used."""
+        with self._lock:
+            return {name: size_mb for name, (_, size_mb) in self._models.items()}
+
+    def _evict(self) -> List[Tuple[str, float]]:
+        evicted = []
+        while len(self._models) > 1 and self._over_budget():
+            name, (_, size_mb) = self._models.popitem(last=False)
+            evicted.append((name, size_mb))
+        return evicted
+
+    def _over_budget(self) -> bool:
+        if self.max_models and len(self._models) > self.max_models:
+            return True
+        total_mb = sum(size_mb for _, size_mb in self._models.values())
+        return bool(self.memory_budget_mb) and total_mb > self.memory_budget_mb
+
+    def _emit(self, kind: str, name: str, size_mb: float, seconds: float):
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        event = ModelEvent(kind, name, size_mb, seconds, timestamp)
+        self.events.append(event)
+        for listener in self._listeners:
+            listener(event)
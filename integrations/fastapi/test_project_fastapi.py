@@ -28,3 +28,98 @@ def test_fastapi_project():
     assert len(result) == len(articles)
     assert [{"text": entry["text"]} for entry in result] == articles
     assert all("ents" in entry for entry in result)
+
+
+def test_admission_cancelled_waiter_is_skipped():
+    import asyncio
+    from scripts.admission import AdmissionController
+
+    async def run():
+        controller = AdmissionController(max_articles=1)
+        await controller.acquire("model", 1, 10)
+        cancelled = asyncio.ensure_future(controller.acquire("model", 1, 10))
+        queued = asyncio.ensure_future(controller.acquire("model", 1, 10))
+        await asyncio.sleep(0)
+        # Cancel the first waiter right before the release wakes it up
+        cancelled.cancel()
+        controller.release("model", 1, 10)
+        await asyncio.sleep(0)
+        assert cancelled.cancelled()
+        assert queued.done() and queued.exception() is None
+        assert controller.in_flight("model") == (1, 10, 0)
+        controller.release("model", 1, 10)
+        assert controller.in_flight("model") == (0, 0, 0)
+
+    asyncio.run(run())
+
+
+def test_batcher_runs_models_concurrently():
+    import asyncio
+    import threading
+    from scripts.batching import MicroBatcher
+
+    # Each batch only finishes once a batch of the other model is running too
+    barrier = threading.Barrier(2, timeout=5)
+
+    def process(model, texts):
+        barrier.wait()
+        return [f"{model}:{text}" for text in texts], {}
+
+    async def run():
+        batcher = MicroBatcher(process, max_wait_ms=0)
+        return await asyncio.gather(batcher.submit("a", ["x"]), batcher.submit("b", ["y"]))
+
+    assert asyncio.run(run()) == [["a:x"], ["b:y"]]
+
+
+def test_batcher_drops_requests_waiting_for_the_executor():
+    import asyncio
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from scripts.batching import DeadlineExceeded, MicroBatcher
+
+    processed = []
+
+    def process(model, texts):
+        processed.append(model)
+        time.sleep(0.5)
+        return texts, {}
+
+    async def run():
+        executor = ThreadPoolExecutor(1)
+        batcher = MicroBatcher(process, max_wait_ms=0, executor=executor, max_concurrency=1, max_batches=1)
+        slow = asyncio.ensure_future(batcher.submit("a", ["x"]))
+        await asyncio.sleep(0.05)
+        # The only worker is busy with the other model's batch until after the deadline
+        loop = asyncio.get_event_loop()
+        with pytest.raises(DeadlineExceeded):
+            await batcher.submit("b", ["y"], deadline=loop.time() + 0.1)
+        assert await slow == ["x"]
+        executor.shutdown()
+
+    asyncio.run(run())
+    assert processed == ["a"]
+
+
+def test_batcher_wait_starts_when_the_request_arrives():
+    import asyncio
+    import time
+    from scripts.batching import MicroBatcher
+
+    def process(model, texts):
+        time.sleep(0.5 if texts == ["x"] else 0.05)
+        return texts, {}
+
+    async def run():
+        batcher = MicroBatcher(process, max_wait_ms=300)
+        loop = asyncio.get_event_loop()
+        first = asyncio.ensure_future(batcher.submit("a", ["x"]))
+        await asyncio.sleep(0.35)
+        # Arrives while the first batch runs, and has waited for more than
+        # max_wait_ms by the time it's done
+        start = loop.time()
+        second = await batcher.submit("a", ["y"])
+        assert await first == ["x"] and second == ["y"]
+        return loop.time() - start
+
+    assert asyncio.run(run()) < 0.65